@@ -45,6 +45,7 @@ from xrhelper import (
     expand_dims,
     coords_init,
     coords_assign,
+    subset_indexers,
     ds_print,
     ds_unpack,
     vars_to_dataset,
@@ -54,30 +55,42 @@ from data import (
     biggify,
     collapse,
     nantrapz,
+    TrapzWeights,
     rolling_mean,
     gradient,
     ncdisp,
     ncload,
     load_concat,
+    load_concat_iter,
     save_nc,
+    is_zarr,
+    nc_encoding,
     mean_over_files,
+    RunningStats,
     pres_units,
     pres_convert,
     precip_units,
     precip_convert,
     get_coord,
+    register_coord_alias,
     subset,
     dim_mean,
     latlon_equal,
     lon_convention,
+    lon_periodic,
     set_lon,
+    Regridder,
     interp_latlon,
+    land_mask,
     mask_oceans,
     mean_over_geobox,
+    mean_over_geoboxes,
     get_ps_clim,
     correct_for_topography,
     near_surface,
+    PlevInterpolator,
     interp_plevels,
+    dp_weights,
     int_pres,
     split_timedim,
     splitdays,
@@ -9,10 +9,16 @@ Utility functions for atmospheric data wrangling / preparation.
 
 from __future__ import division
 import numpy as np
-import pandas as pd
 import collections
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import errno
+import hashlib
+import os
+import random
+import threading
 import scipy.interpolate as interp
-from mpl_toolkits import basemap
+import scipy.signal
+import scipy.sparse
 import xarray as xray
 from xarray import Dataset
 import time
@@ -22,25 +28,67 @@ import atmos.utils as utils
 import atmos.xrhelper as xr
 from atmos.constants import const as constants
 
+# Directory for data cached between sessions (e.g. land/sea masks).
+# Set the ATMOS_CACHE_DIR environment variable to override the default.
+CACHE_DIR = os.environ.get('ATMOS_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.cache',
+                                        'atmos'))
+
+# Maximum total size (bytes) of the files cached by load_concat.  Set the
+# ATMOS_CACHE_MAXSIZE environment variable to override the default.
+CACHE_MAXSIZE = int(float(os.environ.get('ATMOS_CACHE_MAXSIZE', 10e9)))
+
+# Land/sea masks computed in this session, keyed by grid hash
+_land_masks = {}
+
+# Surface pressure climatologies interpolated in this session, keyed by
+# file and grid hash, with the least recently used first.  At most
+# PS_CLIM_MAXGRIDS grids are kept.
+_ps_clims = collections.OrderedDict()
+PS_CLIM_MAXGRIDS = 16
+
+# Names searched for generic coordinate IDs in get_coord.  Use
+# register_coord_alias() to add names for other data conventions.
+COORD_ALIASES = {'lat' : ['lats', 'latitude', 'YDim','Y', 'y'],
+                 'lon' : ['long', 'lons', 'longitude', 'XDim', 'X', 'x'],
+                 'plev' : ['plevel', 'plevels', 'lev', 'level', 'levels',
+                           'Height']}
+
+# Coordinate names found by get_coord, keyed by generic ID and the names
+# of the coordinates in the data
+_coord_names = {}
+
+# Thread for writing files in the background with save_nc
+_nc_writer = None
+
 # ======================================================================
 # NDARRAYS AND XRAY.DATAARRAYS
 # ======================================================================
 
 # ----------------------------------------------------------------------
-def biggify(small, big, tile=False):
+def biggify(small, big, tile=False, dims=None):
     """Add dimensions or tile an array for broadcasting.
 
     Parameters
     ----------
-    small : ndarray
+    small : ndarray or xray.DataArray
         Array which singleton dimensions will be added to.  Its
         dimensions must be a subset of big's dimensions.
-    big : ndarray
+    big : ndarray or xray.DataArray
         Array whose shape will be used to determine the shape of
         the output.
-    tile : bool, optional
+    tile : {False, True, 'view'}, optional
         If True, tile the array along the additional dimensions.
+        If 'view', return a read-only view of the array broadcast to
+        the shape of big, which uses no additional memory.
         If False, add singleton dimensions.
+    dims : str or list of str, optional
+        Names of the dimensions of small, if big is a DataArray.  The
+        dimensions of small are matched with big's by name, and can be
+        in any order.  If small and big are both DataArrays and all of
+        small's dimension names are in big, their names are used by
+        default.  Otherwise, dimensions are matched by their sizes,
+        which is ambiguous if two dimensions of big have the same size.
 
     Returns
     -------
@@ -49,6 +97,71 @@ def biggify(small, big, tile=False):
         for any dimension that is in big but not in small.
     """
 
+    if dims is None and isinstance(small, xray.DataArray):
+        # Match by name only if all of small's dimensions are in big,
+        # otherwise fall back to matching by size
+        if isinstance(big, xray.DataArray):
+            if all([nm in big.dims for nm in small.dims]):
+                dims = small.dims
+    if isinstance(dims, str):
+        dims = [dims]
+    if dims is not None:
+        biggified = _biggify_named(small, big, list(dims))
+    else:
+        biggified = _biggify_sizes(small, big)
+
+    # Expand with tiles if selected
+    if tile == 'view':
+        biggified = np.broadcast_to(biggified, big.shape)
+    elif tile:
+        dbig = big.shape
+        dims = list(biggified.shape)
+
+        # First add any additional singleton dimensions needed to make
+        # biggified of the same dimension as big\
+        for i in range(len(dims), len(dbig)):
+            dims.insert(0, 1)
+
+        # Tile the array
+        for i in range(-1, -1 - len(dims), -1):
+            if dims[i] == dbig[i]:
+                dims[i] = 1
+            else:
+                dims[i] = dbig[i]
+        biggified = np.tile(biggified, dims)
+
+    return biggified
+
+
+# ----------------------------------------------------------------------
+def _biggify_named(small, big, dims):
+    """Add singleton dimensions to small, matching dimension names of big."""
+    if not isinstance(big, xray.DataArray):
+        raise ValueError('big must be a DataArray to match dimension names')
+    for dim in dims:
+        if dim not in big.dims:
+            raise ValueError('Dimension %s not in big dimensions %s' %
+                             (dim, str(big.dims)))
+    if isinstance(small, xray.DataArray):
+        small = small.values
+    small = np.asarray(small)
+    if small.ndim != len(dims):
+        raise ValueError('Dimensions %s do not match small shape %s' %
+                         (str(dims), str(small.shape)))
+
+    # Reorder as in big, then add singleton dimensions
+    order = sorted(range(len(dims)), key=lambda i: big.dims.index(dims[i]))
+    small = np.transpose(small, order)
+    dims = [dims[i] for i in order]
+    shape = [small.shape[dims.index(dim)] if dim in dims else 1
+             for dim in big.dims]
+    return small.reshape(shape)
+
+
+# ----------------------------------------------------------------------
+def _biggify_sizes(small, big):
+    """Add singleton dimensions to small, matching dimension sizes of big."""
+
     debug = False
     dbig, dsmall = big.shape, small.shape
 
@@ -90,23 +203,6 @@ def biggify(small, big, tile=False):
         n -= 1
         ibig -= 1
 
-    # Expand with tiles if selected
-    if tile:
-        dims = list(biggified.shape)
-
-        # First add any additional singleton dimensions needed to make
-        # biggified of the same dimension as big\
-        for i in range(len(dims), len(dbig)):
-            dims.insert(0, 1)
-
-        # Tile the array
-        for i in range(-1, -1 - len(dims), -1):
-            if dims[i] == dbig[i]:
-                dims[i] = 1
-            else:
-                dims[i] = dbig[i]
-        biggified = np.tile(biggified, dims)
-
     return biggified
 
 
@@ -142,99 +238,248 @@ def collapse(arr, axis=-1):
 
 
 # ----------------------------------------------------------------------
-def nantrapz(y, x=None, axis=-1):
+def nantrapz(y, x=None, axis=-1, dtype=None):
     """
     Integrate using the composite trapezoidal rule, ignoring NaNs
 
-    Integrate `ym` (`x`) along given axis, where `ym` is a masked
-    array of `y` with NaNs masked.
+    Integrate `y` (`x`) along given axis, where any interval with a NaN
+    at either end is omitted from the sum.  Points where every interval
+    is omitted are NaN in the output.
 
     Parameters
     ----------
     y : array_like
         Input array to integrate.
     x : array_like, optional
-        If `x` is None, then spacing between all `y` elements is `dx`.
+        If `x` is None, then spacing between all `y` elements is 1.
     axis : int, optional
         Specify the axis.
+    dtype : dtype, optional
+        Data type for accumulating the sums, e.g. np.float32 to save
+        memory with large float32 inputs.  If None, the result type of
+        `y` and `x` (at least float64 for integer inputs) is used.
 
     Returns
     -------
-    trapz : float
+    trapz : float or ndarray
         Definite integral as approximated by trapezoidal rule.
+
+    See Also
+    --------
+    TrapzWeights : Reuse the weights for integrating many arrays.
     """
+    y = np.asarray(y)
+    if x is None:
+        x = np.arange(y.shape[axis], dtype=np.float64)
+    return TrapzWeights(x, axis, dtype).integrate(y)
 
-    ym = np.ma.masked_array(y, np.isnan(y))
-    trapz = np.trapz(ym, x, axis=axis)
 
-    # Convert from masked array back to regular ndarray
-    if isinstance(trapz, np.ma.masked_array):
-        trapz = trapz.filled(np.nan)
+# ----------------------------------------------------------------------
+class TrapzWeights:
+    def __init__(self, x, axis=-1, dtype=None):
+        """Return a TrapzWeights object for NaN-aware trapezoidal sums.
+
+        The interval widths and quadrature weights are computed from x
+        once, and then applied to any number of arrays with integrate().
+        Without NaNs, the integral is a single weighted sum (einsum)
+        along the axis.  With NaNs, the weight of each interval with a
+        NaN at either end is set to zero first, as in nantrapz().
+
+        Parameters
+        ----------
+        x : array_like
+            Sample points.  Either 1-D along the integration axis, or an
+            array with the same number of dimensions as the data to be
+            integrated (broadcastable to its shape).
+        axis : int, optional
+            Axis to integrate along.
+        dtype : dtype, optional
+            Data type for accumulating the sums.  If None, the result
+            type of the data and x is used.
+
+        Returns
+        -------
+        self : TrapzWeights object
+            The TrapzWeights object has the following data attributes:
+              axis : int
+                Integration axis.
+              dx : ndarray
+                Interval widths, with the integration axis last.
+              weights : ndarray
+                Quadrature weights of each point (with the integration
+                axis last) when there are no NaNs.
+
+            And it has the following method:
+              integrate() : Integrate an array.
+        """
+        x = np.asarray(x)
+        if not np.issubdtype(x.dtype, np.floating):
+            x = x.astype(np.float64)
+        self.axis = axis
+        self.dtype = dtype
+        if x.ndim == 1:
+            self.dx = np.diff(x)
+        else:
+            self.dx = np.diff(np.moveaxis(x, axis, -1), axis=-1)
+        shape = self.dx.shape[:-1] + (self.dx.shape[-1] + 1,)
+        self.weights = np.zeros(shape, dtype=self.dx.dtype)
+        self.weights[..., :-1] += self.dx
+        self.weights[..., 1:] += self.dx
+        self.weights *= 0.5
+
+    def __repr__(self):
+        s = 'TrapzWeights (axis %d)\n' % self.axis
+        s = s + '  Points: %d\n' % self.weights.shape[-1]
+        s = s + '  Weights shape: %s\n' % str(self.weights.shape)
+        return s
+
+    def integrate(self, y):
+        """Return the NaN-aware trapezoidal integral of y along the axis."""
+        y = np.moveaxis(np.asarray(y), self.axis, -1)
+        if y.shape[-1] != self.weights.shape[-1]:
+            raise ValueError('Length %d of y along axis does not match x (%d)'
+                             % (y.shape[-1], self.weights.shape[-1]))
+        dtype = self.dtype
+        if dtype is None:
+            dtype = np.result_type(y.dtype, self.dx.dtype)
+        if self.weights.ndim == 1:
+            subs = '...i,i->...'
+        else:
+            subs = '...i,...i->...'
 
-    return trapz
+        valid = ~np.isnan(y)
+        if valid.all():
+            trapz = np.einsum(subs, y, self.weights, dtype=dtype,
+                              casting='same_kind')
+        else:
+            # Omit intervals with a NaN at either end
+            ok = valid[..., :-1] & valid[..., 1:]
+            dx = np.where(ok, self.dx, 0)
+            weights = np.zeros(ok.shape[:-1] + (ok.shape[-1] + 1,),
+                               dtype=dx.dtype)
+            weights[..., :-1] += dx
+            weights[..., 1:] += dx
+            weights *= 0.5
+            trapz = np.einsum('...i,...i->...', np.where(valid, y, 0),
+                              weights, dtype=dtype, casting='same_kind')
+            trapz = np.where(ok.any(axis=-1), trapz, np.nan).astype(dtype)
+        if trapz.ndim == 0:
+            trapz = trapz[()]
+        return trapz
 
 
 # ----------------------------------------------------------------------
-def rolling_mean(data, nroll, axis=-1, center=True, **kwargs):
+def rolling_mean(data, nroll, axis=-1, center=True, min_periods=None,
+                 window=None):
     """Return the rolling mean along an axis.
 
+    NaNs are skipped: each output value is the mean of the non-NaN
+    values within its window, provided there are at least min_periods
+    of them.  The unweighted mean is computed from cumulative sums, so
+    the cost is independent of the window size.  Weighted windows are
+    accumulated one weight at a time from shifted slices of the data,
+    so the memory used is a small multiple of the data size.
+
     Parameters
     ----------
     data : ndarray or xray.DataArray
-        Input data.
+        Input data, with any number of dimensions.
     nroll : int
         Size of window for rolling mean.
-    axis : int, optional
-        Axis to compute along.
+    axis : int or str, optional
+        Axis to compute along.  If data is a DataArray, this can also
+        be a dimension name (or a generic name such as 'time' or 'lat').
     center : bool, optional
-        Align to center of window.
-    **kwargs : other keyword arguments
-        See pandas.rolling_mean.
+        Align to center of window.  If False, each window ends at the
+        output point.
+    min_periods : int, optional
+        Minimum number of non-NaN values in a window required for a
+        non-NaN output.  Defaults to nroll, i.e. any missing value (or
+        a window truncated at the ends of the axis) gives NaN.
+    window : str or 1-D array, optional
+        Weights for a weighted rolling mean.  Either an array of length
+        nroll, or the name of a window accepted by
+        scipy.signal.get_window (e.g. 'triang', 'lanczos', 'hann').
+        If None or 'boxcar', all values are weighted equally.
 
     Returns
     -------
     rolling : ndarray or DataArray
-        Rolling mean data.
+        Rolling mean data.  Floating point inputs keep their precision,
+        other inputs are returned as float64.
     """
 
-    # Maximum number of dimensions handled by this code
-    nmax = 5
-    ndim = data.ndim
-
-    if ndim > 5:
-        raise ValueError('Input data has too many dimensions. Max 5-D.')
-
     if isinstance(data, xray.DataArray):
         name, attrs, coords, dimnames = xr.meta(data)
-        vals = data.values.copy()
+        if isinstance(axis, str):
+            axis = get_coord(data, axis, 'dim')
+        vals = data.values
     else:
-        vals = data
-
-    # Roll axis to end
-    vals = np.rollaxis(vals, axis, ndim)
-
-    # Add singleton dimensions for looping, if necessary
-    for i in range(ndim, nmax):
-        vals = np.expand_dims(vals, axis=0)
-
-    # Initialize output
-    rolling = np.ones(vals.shape, dtype=vals.dtype)
-
-    # Compute rolling mean, iterating over additional dimensions
-    dims = vals.shape[:-1]
-    for i in range(dims[0]):
-        for j in range(dims[1]):
-            for k in range(dims[2]):
-                for m in range(dims[3]):
-                    rolling[i,j,k,m] = pd.rolling_mean(vals[i,j,k,m], nroll,
-                                                       center=center, **kwargs)
+        vals = np.asarray(data)
+
+    nroll = int(nroll)
+    if nroll < 1:
+        raise ValueError('Window size nroll must be a positive integer')
+    if min_periods is None:
+        min_periods = nroll
+    if np.issubdtype(vals.dtype, np.floating):
+        dtype = vals.dtype
+    else:
+        dtype = np.dtype(np.float64)
 
-    # Collapse any additional dimensions that were added
-    for i in range(ndim, rolling.ndim):
-        rolling = rolling[0]
+    # Work with the rolling axis last and accumulate in float64
+    x = np.moveaxis(vals, axis, -1).astype(np.float64)
+    npts = x.shape[-1]
+    valid = ~np.isnan(x)
+    x[~valid] = 0.0
 
-    # Roll axis back to its original position
-    rolling = np.rollaxis(rolling, -1, axis)
+    # Window for output point i is [i - offset, i - offset + nroll)
+    if center:
+        offset = nroll // 2
+    else:
+        offset = nroll - 1
+
+    # Number of valid points in each window, from cumulative sums
+    def window_sums(arr):
+        cs = np.zeros(arr.shape[:-1] + (npts + 1,), dtype=np.float64)
+        np.cumsum(arr, axis=-1, out=cs[..., 1:])
+        ind = np.arange(npts) - offset
+        lo = np.clip(ind, 0, npts)
+        hi = np.clip(ind + nroll, 0, npts)
+        return cs[..., hi] - cs[..., lo]
+
+    counts = window_sums(valid)
+
+    if window is None or (isinstance(window, str) and window == 'boxcar'):
+        num = window_sums(x)
+        den = counts
+    else:
+        if isinstance(window, str):
+            weights = scipy.signal.get_window(window, nroll, fftbins=False)
+        else:
+            weights = np.asarray(window, dtype=np.float64)
+        if weights.shape != (nroll,):
+            raise ValueError('Window weights must be a 1-D array of length %d'
+                             % nroll)
+
+        # Pad so that each output point has a full (zero-weighted)
+        # window, then add up the weighted, shifted slices
+        pad = [(0, 0)] * (x.ndim - 1) + [(offset, nroll - 1 - offset)]
+        xpad = np.pad(x, pad, 'constant')
+        vpad = np.pad(valid.astype(np.float64), pad, 'constant')
+        num = np.zeros(x.shape, dtype=np.float64)
+        den = np.zeros(x.shape, dtype=np.float64)
+        tmp = np.empty(x.shape, dtype=np.float64)
+        for k in range(nroll):
+            if weights[k] == 0:
+                continue
+            num += np.multiply(weights[k], xpad[..., k:k + npts], out=tmp)
+            den += np.multiply(weights[k], vpad[..., k:k + npts], out=tmp)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rolling = num / den
+    rolling[(counts < min_periods) | (counts == 0)] = np.nan
+    rolling = np.moveaxis(rolling.astype(dtype, copy=False), -1, axis)
 
     if isinstance(data, xray.DataArray):
         rolling = xray.DataArray(rolling, name=name, coords=coords,
@@ -244,63 +489,105 @@ def rolling_mean(data, nroll, axis=-1, center=True, **kwargs):
 
 
 # ----------------------------------------------------------------------
-def gradient(data, vec, axis=-1):
+def gradient(data, vec, axis=-1, out=None, period=None):
     """Compute gradient along an axis.
 
+    Uses second-order accurate central differences in the interior
+    (valid for non-uniform coordinate spacing) and first-order
+    one-sided differences at the boundaries, computed in a single
+    vectorized pass over the full array.  For a periodic axis (e.g.
+    longitude on a global grid), central differences that wrap around
+    are used at the boundaries as well.
+
     Parameters
     ----------
     data : np.ndarray or xray.DataArray
-        Input data.
+        Input data, with any number of dimensions.
     vec : 1-dimensional np.ndarray
         Array of coordinates corresponding to axis of differentiation.
+        The spacing does not need to be uniform.
     axis : int, optional
         Axis to differentiate along.
+    out : np.ndarray, optional
+        Array of the same shape as data in which to place the output.
+        If omitted, a new array is allocated.
+    period : float, optional
+        Period of the coordinate if the axis is periodic, e.g. 360 for
+        longitude in degrees spanning the globe.  The last point is
+        then followed by the first point at vec[0] + period.
 
     Returns
     -------
     grad : np.ndarray or xray.DataArray
+        Gradient of data along axis.  Floating point inputs keep their
+        precision (e.g. float32 in, float32 out), other inputs are
+        returned as float64.
     """
-    # Maximum number of dimensions handled by this code
-    nmax = 5
-    ndim = data.ndim
-
-    if ndim > 5:
-        raise ValueError('Input data has too many dimensions. Max 5-D.')
 
     if isinstance(data, xray.DataArray):
         name, attrs, coords, dimnames = xr.meta(data)
-        vals = data.values.copy()
+        vals = data.values
     else:
-        vals = data
-
-    # Roll axis to end
-    vals = np.rollaxis(vals, axis, ndim)
-
-    # Add singleton dimensions for looping, if necessary
-    for i in range(ndim, nmax):
-        vals = np.expand_dims(vals, axis=0)
-
-    # Initialize output
-    grad = np.ones(vals.shape, dtype=vals.dtype)
-
-    # Compute gradient, iterating over additional dimensions
-    dvec = np.gradient(vec)
-    dims = vals.shape[:-1]
-    for i in range(dims[0]):
-        for j in range(dims[1]):
-            for k in range(dims[2]):
-                for m in range(dims[3]):
-                    grad[i,j,k,m] = np.gradient(vals[i,j,k,m], dvec)
-
-    # Collapse any additional dimensions that were added
-    for i in range(ndim, grad.ndim):
-        grad = grad[0]
-
-    # Roll axis back to its original position
-    grad = np.rollaxis(grad, -1, axis)
+        vals = np.asarray(data)
+
+    vec = np.asarray(vec, dtype=np.float64)
+    n = vals.shape[axis]
+    if vec.ndim != 1 or len(vec) != n:
+        msg = 'Length of vec %d does not match data.shape[%d] = %d'
+        raise ValueError(msg % (vec.size, axis, n))
+    if n < 2:
+        raise ValueError('At least 2 points are needed along axis %d' % axis)
+
+    if np.issubdtype(vals.dtype, np.floating):
+        dtype = vals.dtype
+    else:
+        dtype = np.dtype(np.float64)
+
+    if out is None:
+        out = np.empty(vals.shape, dtype=dtype)
+    elif out.shape != vals.shape:
+        raise ValueError('Output array shape %s does not match data shape %s'
+                         % (str(out.shape), str(vals.shape)))
+
+    # Views with the axis of differentiation last, so that the 1-D
+    # coefficients broadcast against the leading dimensions
+    f = np.moveaxis(vals, axis, -1)
+    grad = np.moveaxis(out, axis, -1)
+    dx = np.diff(vec)
+
+    # Interior points: second-order central differences
+    if n > 2:
+        interior = grad[..., 1:-1]
+        dx1, dx2 = dx[:-1], dx[1:]
+        if np.allclose(dx1, dx2):
+            np.subtract(f[..., 2:], f[..., :-2], out=interior)
+            interior *= (1 / (dx1 + dx2)).astype(dtype)
+        else:
+            a = -dx2 / (dx1 * (dx1 + dx2))
+            b = (dx2 - dx1) / (dx1 * dx2)
+            c = dx1 / (dx2 * (dx1 + dx2))
+            np.multiply(f[..., :-2], a.astype(dtype), out=interior)
+            interior += f[..., 1:-1] * b.astype(dtype)
+            interior += f[..., 2:] * c.astype(dtype)
+
+    if period is None:
+        # End points: first-order one-sided differences
+        grad[..., 0] = (f[..., 1] - f[..., 0]) / dx[0]
+        grad[..., -1] = (f[..., -1] - f[..., -2]) / dx[-1]
+    else:
+        # End points: central differences wrapping around the period
+        dx_wrap = vec[0] + period - vec[-1]
+        for i, im, ip, dx1, dx2 in [(0, -1, 1, dx_wrap, dx[0]),
+                                    (-1, -2, 0, dx[-1], dx_wrap)]:
+            a = -dx2 / (dx1 * (dx1 + dx2))
+            b = (dx2 - dx1) / (dx1 * dx2)
+            c = dx1 / (dx2 * (dx1 + dx2))
+            grad[..., i] = a * f[..., im] + b * f[..., i] + c * f[..., ip]
 
     if isinstance(data, xray.DataArray):
-        grad = xray.DataArray(grad, coords=coords, dims=dimnames)
+        grad = xray.DataArray(out, coords=coords, dims=dimnames)
+    else:
+        grad = out
 
     return grad
 
@@ -396,7 +683,59 @@ def precip_convert(precip, units_in, units_out):
 # ======================================================================
 
 # ----------------------------------------------------------------------
-def get_coord(data, coord_name, return_type='values'):
+def register_coord_alias(coord_name, aliases):
+    """Add names to search for a generic coordinate name in get_coord().
+
+    Parameters
+    ----------
+    coord_name : str
+        Generic coordinate ID, e.g. 'lat', or a new one, e.g. 'sigma'.
+    aliases : str or list of str
+        Names used for this coordinate by a model or data set, e.g.
+        'nav_lat'.  They are searched after the existing names.
+    """
+    names = COORD_ALIASES.setdefault(coord_name, [])
+    for nm in utils.makelist(aliases):
+        if nm not in names:
+            names.append(nm)
+    _coord_names.clear()
+
+
+# ----------------------------------------------------------------------
+def _resolve_coord_name(coord_name, coords):
+    """Return the name in coords matching generic coord_name."""
+    # Cached by coordinate names, since get_coord is typically called
+    # many times on the same or similar data
+    key = (coord_name, tuple(coords))
+    name = _coord_names.get(key)
+    if name is not None:
+        return name
+
+    if coord_name in coords:
+        name = coord_name
+    else:
+        nms = [coord_name, coord_name.lower(), coord_name.upper(),
+               coord_name.capitalize()] + COORD_ALIASES.get(coord_name, [])
+        found = []
+        for nm in nms:
+            if nm in coords and nm not in found:
+                found.append(nm)
+        if len(found) == 0:
+            raise ValueError("Can't find coordinate name in data coords %s" %
+                             list(coords))
+        if len(found) > 1:
+            raise ValueError('Conflicting possible coord names in coords %s'
+                % list(coords))
+        name = found[0]
+
+    if len(_coord_names) >= 1000:
+        _coord_names.clear()
+    _coord_names[key] = name
+    return name
+
+
+# ----------------------------------------------------------------------
+def get_coord(data, coord_name, return_type='values', copy=True):
     """Return values, name or dimension of coordinate in DataArray.
 
     Parameters
@@ -412,6 +751,9 @@ def get_coord(data, coord_name, return_type='values'):
         'values' : Return an array of coordinate values.
         'name' : Return the name of the coordinate.
         'dim' : Return the dimension of the coordinate.
+    copy : bool, optional
+        If True, return a copy of the coordinate values.  Otherwise
+        return a read-only view of them.
 
     Returns
     -------
@@ -423,37 +765,19 @@ def get_coord(data, coord_name, return_type='values'):
     'plev' : ['plevel', 'plevels', 'lev', 'level',
               'levels', 'Height']
     as well as capitalization options for coord_name (.upper(),
-    .lower(), .capitalize())
+    .lower(), .capitalize()) and any names added with
+    register_coord_alias().  The name found for each set of coordinate
+    names is cached.
     """
 
-    def name_options(nm):
-        opts = {'lat' : ['lats', 'latitude', 'YDim','Y', 'y'],
-                'lon' : ['long', 'lons', 'longitude', 'XDim', 'X', 'x'],
-                'plev' : ['plevel', 'plevels', 'lev', 'level', 'levels',
-                          'Height']}
-
-        nms = list(set([nm, nm.lower(), nm.upper(), nm.capitalize()]))
-        if opts.get(nm) is not None:
-            nms = list(nms) + opts[nm]
-        return nms
-
-    names = name_options(coord_name)
-
-    # Look in list of common coordinate names
-    if coord_name not in data.coords:
-        found = [i for i, s in enumerate(names) if s in data.coords]
-
-        if len(found) == 0:
-            raise ValueError("Can't find coordinate name in data coords %s" %
-                             data.coords.keys())
-        if len(found) > 1:
-            raise ValueError('Conflicting possible coord names in coords %s'
-                % data.coords.keys())
-        else:
-            coord_name = names[found[0]]
+    coord_name = _resolve_coord_name(coord_name, data.coords)
 
     if return_type == 'values':
-        output = data[coord_name].values.copy()
+        if copy:
+            output = data[coord_name].values.copy()
+        else:
+            output = data.coords[coord_name].values.view()
+            output.flags.writeable = False
     elif return_type == 'name':
         output = coord_name
     elif return_type == 'dim':
@@ -525,7 +849,8 @@ def subset(data, subset_dict, incl_lower=True, incl_upper=True, search=True,
 
 
 # ----------------------------------------------------------------------
-def dim_mean(data, dimname, lower=None, upper=None, minfrac=0.5):
+def dim_mean(data, dimname, lower=None, upper=None, minfrac=0.5,
+             return_count=False, return_std=False):
     """Return the mean of a DataArray along dimension, preserving attributes.
 
     Parameters
@@ -540,10 +865,17 @@ def dim_mean(data, dimname, lower=None, upper=None, minfrac=0.5):
         the dimension before averaging.
     minfrac : float, optional
         Mininum fraction of non-missings required for non-NaN output.
+    return_count : bool, optional
+        If True, also return the number of non-missing values averaged.
+    return_std : bool, optional
+        If True, also return the standard deviation (NaN-aware, with
+        the same minfrac threshold as the mean).
 
     Returns
     -------
     databar : xray.DataArray or xray.Dataset
+    count : xray.DataArray or xray.Dataset (if return_count is True)
+    std : xray.DataArray or xray.Dataset (if return_std is True)
     """
 
     def one_variable(var, dimname, dimvals, minfrac):
@@ -551,59 +883,137 @@ def dim_mean(data, dimname, lower=None, upper=None, minfrac=0.5):
             axis = get_coord(var, dimname, 'dim')
         except ValueError:
             # Dimension isn't in the data variable
-            return var
+            return var, None, None
 
-        attrs = var.attrs
+        attrs = collections.OrderedDict(var.attrs)
         attrs['avg_over_' + dimname] = dimvals
         attrs['minfrac'] = minfrac
 
-        # Create mask for any point where more than minfrac fraction is missing
-        missings = np.isnan(var)
-        missings = missings.sum(dim=dimname)
-        min_num = var.shape[axis] * minfrac
-        mask = missings > min_num
-
-        # Compute mean and apply mask
-        var = var.mean(dim=dimname)
-        name, _, coords, dims = xr.meta(var)
-        vals = np.ma.masked_array(var.values, mask).filled(np.nan)
-        var_out = xray.DataArray(vals, name=name, attrs=attrs, dims=dims,
-                                 coords=coords)
-
-        return var_out
+        # Sum and number of non-missing values in one pass over the data
+        vals = var.values
+        if vals.dtype.kind == 'f':
+            dtype = vals.dtype
+        else:
+            dtype = np.float64
+        valid = ~np.isnan(vals)
+        count = valid.sum(axis=axis)
+        total = np.where(valid, vals, 0).sum(axis=axis, dtype=np.float64)
 
+        # Mask any point where more than minfrac fraction is missing
+        min_num = var.shape[axis] * minfrac
+        mask = (var.shape[axis] - count) > min_num
+        mask |= count == 0
+        nvalid = np.maximum(count, 1)
+        mean = total / nvalid
+
+        dims = var.dims[:axis] + var.dims[axis + 1:]
+        coords = collections.OrderedDict()
+        for nm in var.coords:
+            if dimname not in var.coords[nm].dims:
+                coords[nm] = var.coords[nm]
+        vals_out = np.where(mask, np.nan, mean).astype(dtype)
+        var_out = xray.DataArray(vals_out, name=var.name, attrs=attrs,
+                                 dims=dims, coords=coords)
+        count_out, std_out = None, None
+        if return_count:
+            count_out = xray.DataArray(count, name=var.name, dims=dims,
+                                       coords=coords)
+        if return_std:
+            dev = vals - np.expand_dims(mean, axis)
+            dev = np.where(valid, dev, 0)
+            std = np.where(mask, np.nan,
+                           np.sqrt((dev * dev).sum(axis=axis) / nvalid))
+            std_out = xray.DataArray(std.astype(dtype), name=var.name,
+                                     attrs=attrs, dims=dims, coords=coords)
+
+        return var_out, count_out, std_out
+
+    databar, count, std = data, None, None
     if dimname not in data.dims:
         try:
             dimname = get_coord(data, dimname, 'name')
         except ValueError:
             # Dimension isn't in the data variable
-            return data
-
-    if lower is not None:
-        data = subset(data, {dimname : (lower, upper)}, copy=False)
-
-    dimvals = get_coord(data, coord_name=dimname)
-    if isinstance(data, xray.DataArray):
-        databar = one_variable(data, dimname, dimvals, minfrac)
-    elif isinstance(data, xray.Dataset):
-        databar = xray.Dataset()
-        databar.attrs = data.attrs
-        for nm in data.data_vars:
-            databar[nm] = one_variable(data[nm], dimname, dimvals, minfrac)
-    else:
-        raise ValueError('Input data must be xray.DataArray or xray.Dataset')
+            dimname = None
+
+    if dimname is not None:
+        if lower is not None:
+            data = subset(data, {dimname : (lower, upper)}, copy=False)
+        dimvals = get_coord(data, coord_name=dimname)
+        if isinstance(data, xray.DataArray):
+            databar, count, std = one_variable(data, dimname, dimvals,
+                                               minfrac)
+        elif isinstance(data, xray.Dataset):
+            databar = xray.Dataset()
+            count, std = xray.Dataset(), xray.Dataset()
+            databar.attrs = data.attrs
+            for nm in data.data_vars:
+                var_out, count_out, std_out = one_variable(
+                    data[nm], dimname, dimvals, minfrac)
+                databar[nm] = var_out
+                if count_out is not None:
+                    count[nm] = count_out
+                if std_out is not None:
+                    std[nm] = std_out
+        else:
+            raise ValueError('Input data must be xray.DataArray or '
+                             'xray.Dataset')
 
-    return databar
+    output = [databar]
+    if return_count:
+        output.append(count)
+    if return_std:
+        output.append(std)
+    if len(output) == 1:
+        return databar
+    return tuple(output)
 
 
 # ======================================================================
 # NETCDF FILE I/O
 # ======================================================================
 
+# ----------------------------------------------------------------------
+def is_zarr(path):
+    """Return True if path is a Zarr store (a '.zarr' path or directory).
+
+    All the file I/O functions in this module read and write Zarr
+    directory stores as well as netCDF files, based on this test.
+    """
+    return path.rstrip('/').endswith('.zarr') or os.path.isdir(path)
+
+
+# ----------------------------------------------------------------------
+def _open_dataset(path, **kwargs):
+    """Open a netCDF file or Zarr store with xray.open_dataset()."""
+    if is_zarr(path):
+        kwargs['engine'] = 'zarr'
+    return xray.open_dataset(path, **kwargs)
+
+
+# ----------------------------------------------------------------------
+def _zarr_encoding(encoding):
+    """Convert netCDF4 encoding from nc_encoding() to Zarr encoding.
+
+    Chunk sizes and packing carry over.  The zlib options are dropped,
+    since Zarr stores are compressed by default.
+    """
+    encoding_out = {}
+    for nm, enc in encoding.items():
+        enc_out = {}
+        for key, val in enc.items():
+            if key == 'chunksizes':
+                enc_out['chunks'] = val
+            elif key not in ['zlib', 'complevel', 'shuffle', 'contiguous']:
+                enc_out[key] = val
+        encoding_out[nm] = enc_out
+    return encoding_out
+
+
 # ----------------------------------------------------------------------
 def ncdisp(filename, verbose=True, decode_cf=False, indent=2, width=None):
     """Display the attributes of data in a netcdf file."""
-    with xray.open_dataset(filename, decode_cf=decode_cf) as ds:
+    with _open_dataset(filename, decode_cf=decode_cf) as ds:
         if verbose:
             xr.ds_print(ds, indent, width)
         else:
@@ -613,20 +1023,44 @@ def ncdisp(filename, verbose=True, decode_cf=False, indent=2, width=None):
 # ----------------------------------------------------------------------
 def ncload(filename, verbose=True, unpack=True, missing_name=u'missing_value',
            offset_name=u'add_offset', scale_name=u'scale_factor',
-           decode_cf=False):
+           decode_cf=False, dtype=np.float64, lazy=False):
     """
     Read data from netcdf file into xray dataset.
 
     If options are selected, unpacks from compressed form and/or replaces
     missing values with NaN.  Returns data as an xray.Dataset object.
+
+    Unpacked data is of type dtype (e.g. np.float32 to halve the memory).
+    If lazy is True, the file is left open and each variable is read
+    and unpacked only when its values are accessed, using xray's own
+    decoding (so the float type is chosen by xray rather than dtype).
+    Call ds.close() when finished with it.
     """
-    with xray.open_dataset(filename, decode_cf=decode_cf) as ds:
+    if lazy:
+        ds = _open_dataset(filename, decode_cf=False)
+        print_if('****** Opening file: ' + filename + '********', verbose)
+        print_if(ds, verbose, printfunc=xr.ds_print)
+        if unpack:
+            # Use the attribute names that xray's decoder recognizes
+            names = {missing_name : u'missing_value',
+                     offset_name : u'add_offset',
+                     scale_name : u'scale_factor'}
+            for var in ds.data_vars:
+                attrs = ds[var].attrs
+                for nm in names:
+                    if nm in attrs and nm != names[nm]:
+                        attrs[names[nm]] = attrs.pop(nm)
+        ds = xray.decode_cf(ds, mask_and_scale=unpack,
+                            decode_times=decode_cf, decode_coords=decode_cf)
+        return ds
+
+    with _open_dataset(filename, decode_cf=decode_cf) as ds:
         print_if('****** Reading file: ' + filename + '********', verbose)
         print_if(ds, verbose, printfunc=xr.ds_print)
         if unpack:
             print_if('****** Unpacking data *********', verbose)
             ds = xr.ds_unpack(ds, verbose=verbose, missing_name=missing_name,
-                offset_name=offset_name, scale_name=scale_name)
+                offset_name=offset_name, scale_name=scale_name, dtype=dtype)
 
         # Use the load() function so that the dataset is available after
         # the file is closed
@@ -634,9 +1068,278 @@ def ncload(filename, verbose=True, unpack=True, missing_name=u'missing_value',
         return ds
 
 
+# ----------------------------------------------------------------------
+def _subset_names(data, subset_dict):
+    """Return subset_dict with generic dimension names replaced.
+
+    Generic names ('lat', 'lon', 'plev') that aren't in data.dims are
+    replaced with the actual names found by get_coord().
+    """
+    subset_dict = dict(subset_dict)
+    for dim_name in list(subset_dict.keys()):
+        if dim_name in ['lat', 'lon', 'plev'] and dim_name not in data.dims:
+            dim_name_new = get_coord(data, dim_name, 'name')
+            subset_dict[dim_name_new] = subset_dict.pop(dim_name)
+    return subset_dict
+
+
+# ----------------------------------------------------------------------
+def _load_piece(path, var_ids=None, subset_dict=None, func=None,
+                func_args=None, func_kw=None, chunks=None):
+    """Read one file for load_concat() and related functions.
+
+    If chunks is None, the data is loaded into memory and the file is
+    closed.  Otherwise the file is opened with dask chunks and the
+    output is left unevaluated (and the file open).
+    """
+    ds = _open_dataset(path, chunks=chunks)
+    try:
+        if subset_dict is not None:
+            # Select the hyperslab before any data values are read
+            subset_dict = _subset_names(ds, subset_dict)
+            ds = ds.isel(**xr.subset_indexers(ds, subset_dict))
+        if var_ids is None:
+            # All variables
+            data = ds
+        else:
+            # Extract specific variables
+            data = ds[var_ids]
+        if func is not None:
+            data_out = xray.Dataset()
+            if func_args is None:
+                func_args = []
+            if func_kw is None:
+                func_kw = {}
+            for nm in data.data_vars:
+                vars_out = func(data[nm], *func_args, **func_kw)
+                if not isinstance(vars_out, xray.Dataset):
+                    vars_out = vars_out.to_dataset()
+                for nm2 in vars_out.data_vars:
+                    data_out[nm2] = vars_out[nm2]
+            data = data_out
+        if chunks is None:
+            data.load()
+    finally:
+        if chunks is None:
+            ds.close()
+    return data
+
+
+# ----------------------------------------------------------------------
+def _load_piece_retry(path, load_kw, verbose=True, nmax=3, wait=5):
+    """Call _load_piece(path, **load_kw), retrying on read errors.
+
+    Up to nmax attempts are made (in case of server problems), with an
+    exponential backoff starting from wait seconds.  The wait times are
+    randomized so that concurrent requests don't all retry at once.
+    Missing files and permission errors are raised immediately, since
+    retrying won't fix them.
+    """
+    attempt = 0
+    while True:
+        try:
+            return _load_piece(path, **load_kw)
+        except (RuntimeError, IOError, OSError) as err:
+            if getattr(err, 'errno', None) in (errno.ENOENT, errno.EACCES,
+                                               errno.EPERM):
+                raise
+            attempt += 1
+            if attempt >= nmax:
+                raise err
+            seconds = wait * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+            print_if('Error reading %s.  Attempting again in %.1f s' %
+                     (path, seconds), verbose)
+            time.sleep(seconds)
+
+
+# ----------------------------------------------------------------------
+def _load_concat_setup(paths, var_ids, func_kw, verbose, callback,
+                       cache=False, offline=False):
+    """Standardize the inputs shared by load_concat and load_concat_iter."""
+    paths = utils.makelist(paths)
+    if var_ids is not None:
+        var_ids = utils.makelist(var_ids)
+    func_kw = utils.makelist(func_kw)
+    if len(func_kw) == 1:
+        func_kw *= len(paths)
+    cache = cache or offline
+
+    if callback is None and verbose:
+        def callback(i, path, seconds):
+            print('Loaded %d/%d %s (%.1f s)' % (i + 1, len(paths), path,
+                                               seconds))
+
+    def get_piece(i, subset_dict, func, func_args, chunks=None):
+        t0 = time.time()
+        load_kw = {'var_ids' : var_ids, 'subset_dict' : subset_dict,
+                   'func' : func, 'func_args' : func_args,
+                   'func_kw' : func_kw[i], 'chunks' : chunks}
+        if cache and chunks is None:
+            piece = _load_piece_cached(paths[i], load_kw, verbose, offline)
+        else:
+            piece = _load_piece_retry(paths[i], load_kw, verbose)
+        if callback is not None:
+            callback(i, paths[i], time.time() - t0)
+        return piece
+
+    return paths, get_piece
+
+
+# ----------------------------------------------------------------------
+def _func_key(func):
+    """Return a key identifying func by name and compiled code.
+
+    Edited functions and different lambdas get different keys.  Nested
+    code objects (comprehensions, lambdas and inner functions) are
+    replaced by their own code and constants, since their repr includes
+    a memory address that changes in every new process.
+    """
+    def code_key(obj):
+        if hasattr(obj, 'co_code'):
+            return ('code', obj.co_code, code_key(obj.co_consts))
+        elif isinstance(obj, (tuple, list, frozenset)):
+            items = [code_key(item) for item in obj]
+            if isinstance(obj, frozenset):
+                items = sorted(items, key=repr)
+            return (type(obj).__name__, tuple(items))
+        else:
+            return obj
+
+    code = getattr(func, '__code__', None)
+    if code is not None:
+        code = code_key(code)
+    return (getattr(func, '__module__', None),
+            getattr(func, '__name__', repr(func)), code)
+
+
+# ----------------------------------------------------------------------
+def _load_piece_cached(path, load_kw, verbose=True, offline=False):
+    """Return _load_piece(path, **load_kw), using a cache in CACHE_DIR.
+
+    The cache is keyed by the path (and modification time, for local
+    files), variables, subset and func with its arguments.  Files in
+    the cache are used least recently used first when the total size
+    exceeds CACHE_MAXSIZE.  If offline is True, an IOError is raised
+    if the data isn't in the cache.
+    """
+    func = load_kw['func']
+    if func is not None:
+        func = _func_key(func)
+    mtime = None
+    if os.path.exists(path):
+        mtime = os.path.getmtime(path)
+    key = _grid_hash(path, mtime, load_kw['var_ids'], load_kw['subset_dict'],
+                     func, load_kw['func_args'], load_kw['func_kw'])
+    subdir = 'load_concat'
+    filename = os.path.join(CACHE_DIR, subdir, '%s.nc' % key)
+    if os.path.exists(filename):
+        try:
+            piece = _load_piece(filename)
+        except (RuntimeError, IOError, OSError):
+            # Deleted by another process or corrupted, so read again
+            pass
+        else:
+            print_if('Using cached data for %s' % path, verbose)
+            # Update modification time to mark as recently used
+            os.utime(filename, None)
+            return piece
+    if offline:
+        raise IOError('Data for %s is not in cache %s (offline mode)'
+                      % (path, os.path.dirname(filename)))
+    piece = _load_piece_retry(path, load_kw, verbose)
+    filename = _cache_path(subdir, '%s.nc' % key)
+    _save_atomic(filename, piece.to_netcdf, use_path=True)
+    _cache_evict(subdir, CACHE_MAXSIZE, keep=filename)
+    return piece
+
+
+# ----------------------------------------------------------------------
+def load_concat_iter(paths, var_ids=None, subset_dict=None, func=None,
+                     func_args=None, func_kw=None, verbose=True,
+                     callback=None, cache=False, offline=False):
+    """Generator version of load_concat() which yields one file at a time.
+
+    Only one file's worth of data is held in memory at any time, so
+    reductions (e.g. a time mean) can be accumulated over long
+    sequences of files in constant memory.
+
+    Parameters
+    ----------
+    paths, var_ids, subset_dict, func, func_args, func_kw, verbose,
+    callback, cache, offline :
+        See load_concat().
+
+    Yields
+    ------
+    piece : xray.Dataset
+        Data extracted from each file, in the same order as paths,
+        after subsetting and applying func.
+    """
+    paths, get_piece = _load_concat_setup(paths, var_ids, func_kw, verbose,
+                                          callback, cache, offline)
+    for i in range(len(paths)):
+        yield get_piece(i, subset_dict, func, func_args)
+
+
+# ----------------------------------------------------------------------
+def _write_append(outfile, piece, concat_dim, first, encoding=None):
+    """Write piece to outfile, appending along concat_dim if not first.
+
+    If outfile is a Zarr store (see is_zarr()), pieces are appended
+    with xray's Zarr writer.  Otherwise a netCDF file is created with
+    concat_dim as its unlimited dimension and subsequent pieces are
+    appended with the netCDF4 library, using the packing and time units
+    of the existing variables in the file.  The encoding (e.g. from
+    nc_encoding()) is used when creating the file.
+    Variables without concat_dim are written from the first piece only.
+    """
+    if concat_dim not in piece.dims:
+        piece = piece.expand_dims(concat_dim)
+    if is_zarr(outfile):
+        if first:
+            piece.to_zarr(outfile, mode='w',
+                          encoding=_zarr_encoding(encoding or {}))
+        else:
+            piece.to_zarr(outfile, append_dim=concat_dim)
+        return
+    if first:
+        piece.to_netcdf(outfile, unlimited_dims=[concat_dim],
+                        encoding=encoding)
+        return
+
+    import netCDF4
+    attrs_enc = ['units', 'calendar', 'scale_factor', 'add_offset',
+                 '_FillValue']
+    with netCDF4.Dataset(outfile, 'a') as nc:
+        nc.set_auto_maskandscale(False)
+        n = len(nc.dimensions[concat_dim])
+        variables = collections.OrderedDict()
+        for nm in piece.variables:
+            var = piece.variables[nm]
+            if concat_dim not in var.dims:
+                continue
+            if nm not in nc.variables:
+                raise ValueError('Variable %s not in %s' % (nm, outfile))
+            ncvar = nc.variables[nm]
+            var = var.copy(deep=False)
+            var.encoding = {att : ncvar.getncattr(att) for att in attrs_enc
+                            if att in ncvar.ncattrs()}
+            var.encoding['dtype'] = ncvar.dtype
+            variables[nm] = var.transpose(*ncvar.dimensions)
+        variables, _ = xray.conventions.cf_encoder(variables, {})
+        for nm in variables:
+            var = variables[nm]
+            ind = [slice(None)] * var.ndim
+            axis = var.dims.index(concat_dim)
+            ind[axis] = slice(n, n + var.shape[axis])
+            nc.variables[nm][tuple(ind)] = var.values
+
+
 # ----------------------------------------------------------------------
 def load_concat(paths, var_ids=None, concat_dim='TIME', subset_dict=None,
-                func=None, func_args=None, func_kw=None, squeeze=True, verbose=True):
+                func=None, func_args=None, func_kw=None, squeeze=True,
+                verbose=True, max_workers=None, callback=None, chunks=None,
+                outfile=None, cache=False, offline=False):
     """Load a variable from multiple files and concatenate into one.
 
     Especially useful for extracting variables split among multiple
@@ -666,6 +1369,9 @@ def load_concat(paths, var_ids=None, concat_dim='TIME', subset_dict=None,
         - upper : int, float, or None
             Upper bound for subset range. If lower_or_list is a list,
             then upper is ignored and should be set to None.
+        The subset is converted to integer indices from the coordinates
+        as soon as each file is opened, so that only the selected
+        hyperslab of each variable is read.
     func : function, optional
         Function to apply to each variable in each file before concatenating.
         e.g. compute zonal mean. Takes one DataArray as first input parameter.
@@ -678,115 +1384,459 @@ def load_concat(paths, var_ids=None, concat_dim='TIME', subset_dict=None,
         path[i]. Otherwise, make func_kw a single dict to use for all paths.
     squeeze : bool, optional
         If True, squeeze out extra dimensions and add info to attributes.
+        If chunks or outfile is provided, the squeezed dimensions are
+        kept as scalar coordinates instead, so that the data is not
+        loaded into memory.
     verbose : bool, optional
         If True, print updates while processing files.
+    max_workers : int, optional
+        If provided, read up to this many files concurrently in a pool
+        of threads.  The output is in the same order as paths.  Whether
+        reads actually overlap depends on the backend (e.g. the netCDF4
+        library is not thread-safe and xray serializes calls to it).
+        Ignored if chunks or outfile is provided.
+    callback : function, optional
+        Function called as callback(i, path, seconds) after each file
+        is read, where i is the index of path in paths and seconds is
+        the time taken, including any retries.  If None and verbose
+        is True, a line is printed for each file.
+    chunks : int or dict, optional
+        If provided, open each file lazily with these dask chunk sizes
+        and return an unevaluated (dask-backed) result, with func
+        applied to each file as the data is computed.  Requires dask.
+    outfile : str, optional
+        If provided, each file's data is written to outfile as soon as
+        it is read, instead of concatenating in memory, so that only
+        one file's worth of data is held at a time.  If outfile is a
+        Zarr store (see is_zarr()) it is written as Zarr, otherwise as
+        netCDF with concat_dim as the unlimited dimension.  Any
+        existing outfile is overwritten.
+    cache : bool, optional
+        If True, the data read from each path (after subsetting and
+        applying func) is saved in a netCDF file in CACHE_DIR, and
+        later calls with the same path, var_ids, subset_dict, func,
+        func_args and func_kw read it from there instead.  Local paths
+        are read again if modified.  The least recently used files are
+        deleted when the cache exceeds CACHE_MAXSIZE bytes.  Ignored
+        if chunks is provided.
+    offline : bool, optional
+        If True, read only from the cache and raise an IOError for any
+        path that isn't cached.  Implies cache=True.
 
     Returns:
     --------
     data : xray.DataArray or xray.Dataset
-        Data extracted from input files.
-    """
+        Data extracted from input files.  If outfile is provided, the
+        output is opened from outfile without loading it into memory.
 
-    # Number of times to attempt opening file (in case of server problems)
-    NMAX = 3
-    # Wait time (seconds) between attempts
-    WAIT = 5
+    See Also
+    --------
+    load_concat_iter : Generator yielding the data from each file.
+    """
 
-    if var_ids is not None:
-        var_ids = utils.makelist(var_ids)
+    paths, get_piece = _load_concat_setup(paths, var_ids, func_kw, verbose,
+                                          callback, cache, offline)
 
-    def get_data(path, var_ids, subset_dict, func, func_args, func_kw):
-        with xray.open_dataset(path) as ds:
-            if var_ids is None:
-                # All variables
-                data = ds
-            else:
-                # Extract specific variables
-                data = ds[var_ids]
-            if subset_dict is not None:
-                data = subset(data, subset_dict, copy=False)
-            if func is not None:
-                data_out = xray.Dataset()
-                if func_args is None:
-                    func_args = []
-                if func_kw is None:
-                    func_kw = {}
-                for nm in data.data_vars:
-                    vars_out = func(data[nm], *func_args, **func_kw)
-                    if not isinstance(vars_out, xray.Dataset):
-                        vars_out = vars_out.to_dataset()
-                    for nm2 in vars_out.data_vars:
-                        data_out[nm2] = vars_out[nm2]
-                data = data_out
-            data.load()
-        return data
+    print_if(None, verbose, printfunc=disptime)
+    if outfile is not None:
+        for i in range(len(paths)):
+            piece = get_piece(i, subset_dict, func, func_args)
+            _write_append(outfile, piece, concat_dim, first=(i == 0))
+            del piece
+        data = _open_dataset(outfile)
+        if squeeze:
+            data = data.squeeze()
+    else:
+        if chunks is not None:
+            pieces = [get_piece(i, subset_dict, func, func_args, chunks)
+                      for i in range(len(paths))]
+        elif max_workers is None:
+            pieces = [get_piece(i, subset_dict, func, func_args)
+                      for i in range(len(paths))]
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                pieces = list(executor.map(
+                    lambda i: get_piece(i, subset_dict, func, func_args),
+                    range(len(paths))))
 
-    pieces = []
-    func_kw = utils.makelist(func_kw)
-    paths = utils.makelist(paths)
-    if len(func_kw) == 1:
-        func_kw *= len(paths)
-    for p, kw in zip(paths, func_kw):
+        print_if('Concatenating data', verbose)
+        data = xray.concat(pieces, dim=concat_dim)
         print_if(None, verbose, printfunc=disptime)
-        print_if('Loading ' + p, verbose)
-        attempt = 0
-        while attempt < NMAX:
-            try:
-                piece = get_data(p, var_ids, subset_dict, func, func_args, kw)
-                print_if('Appending data', verbose)
-                pieces.append(piece)
-                attempt = NMAX
-            except RuntimeError as err:
-                attempt += 1
-                if attempt < NMAX:
-                    print('Error reading file.  Attempting again in %d s' %
-                          WAIT)
-                    time.sleep(WAIT)
-                else:
-                    raise err
-
-    print_if('Concatenating data', verbose)
-    data = xray.concat(pieces, dim=concat_dim)
-    print_if(None, verbose, printfunc=disptime)
 
-    if squeeze:
-        data = xr.squeeze(data)
+        if squeeze and chunks is not None:
+            data = data.squeeze()
+        elif squeeze:
+            data = xr.squeeze(data)
 
     if len(data.data_vars) == 1:
         # Convert from Dataset to DataArray for output
-        data = data[data.data_vars.keys()[0]]
+        data = data[list(data.data_vars.keys())[0]]
 
     return data
 
 
 # ----------------------------------------------------------------------
-def save_nc(filename, *args):
-    """Save xray.DataArray variables to a netcdf file.
+def _var_option(option, nm):
+    """Return option for variable nm, if option is a dict keyed by name."""
+    if isinstance(option, dict):
+        return option.get(nm)
+    return option
 
-    Call Signatures
-    ---------------
-    save_nc(filename, var1)
-    save_nc(filename, var1, var2)
-    save_nc(filename, var1, var2, var3)
-    etc...
 
-    Parameters
-    ----------
-    filename : string
-        File path for saving.
-    var1, var2, ... : xray.DataArrays
-        List of xray.DataArrays with compatible coordinates.
+# ----------------------------------------------------------------------
+def _auto_chunks(var, nbytes=2**20):
+    """Return time-major netCDF chunk sizes for a variable.
+
+    The last two (horizontal) dimensions are stored whole and the other
+    dimensions one element at a time, except that the first (time)
+    dimension is grouped to make chunks of about nbytes.
     """
+    shape = var.shape
+    if len(shape) <= 2:
+        return tuple(shape)
+    chunks = [1] * (len(shape) - 2) + list(shape[-2:])
+    slab = int(np.prod(chunks)) * var.dtype.itemsize
+    chunks[0] = int(min(shape[0], max(1, nbytes // max(slab, 1))))
+    return tuple(chunks)
 
-    ds = xr.vars_to_dataset(*args)
-    ds.to_netcdf(filename)
-    return None
+
+# ----------------------------------------------------------------------
+def _pack_int16(vals):
+    """Return scale_factor and add_offset to pack vals into int16."""
+    vmin, vmax = np.nanmin(vals), np.nanmax(vals)
+    if not np.isfinite(vmin) or vmin == vmax:
+        return 1.0, float(vmin) if np.isfinite(vmin) else 0.0
+    # Values from -32766 to 32766, with -32767 reserved for missing
+    scale = (vmax - vmin) / (2**16 - 4)
+    offset = (vmax + vmin) / 2.0
+    return float(scale), float(offset)
+
+
+# ----------------------------------------------------------------------
+def nc_encoding(ds, complevel=None, shuffle=True, chunks=None, pack=False):
+    """Return netCDF4 encoding dict for compression, chunking and packing.
+
+    Parameters
+    ----------
+    ds : xray.Dataset
+        Data to be saved.
+    complevel : int or dict, optional
+        zlib compression level (1-9).  If None, no compression.
+    shuffle : bool or dict, optional
+        If True, apply the HDF5 shuffle filter before compressing.
+    chunks : tuple, 'auto' or dict, optional
+        Chunk sizes.  If 'auto', or if None and complevel is set, chunks
+        are chosen by _auto_chunks() (whole lat-lon slabs, grouped
+        along the first dimension).  If None otherwise, the netCDF
+        library default is used.
+    pack : bool or dict, optional
+        If True, pack data into int16 with scale_factor and add_offset
+        computed from the range of the data.  Missing values are
+        written as -32767.
+
+    Each option can be a single value used for all data variables, or
+    a dict keyed by variable name (variables not in the dict use the
+    default).
+
+    Returns
+    -------
+    encoding : dict
+        Encoding dict for xray.Dataset.to_netcdf().
+    """
+    encoding = {}
+    for nm in ds.data_vars:
+        var = ds[nm]
+        enc = {}
+        level = _var_option(complevel, nm)
+        if level is not None and level > 0:
+            enc['zlib'] = True
+            enc['complevel'] = int(level)
+            shuf = _var_option(shuffle, nm)
+            enc['shuffle'] = True if shuf is None else bool(shuf)
+        chunk = _var_option(chunks, nm)
+        if var.ndim > 0:
+            if chunk == 'auto' or (chunk is None and 'zlib' in enc):
+                enc['chunksizes'] = _auto_chunks(var)
+            elif chunk is not None:
+                enc['chunksizes'] = tuple(chunk)
+        if _var_option(pack, nm) and var.dtype.kind == 'f':
+            scale, offset = _pack_int16(var.values)
+            enc.update({'dtype' : 'int16', 'scale_factor' : scale,
+                        'add_offset' : offset, '_FillValue' : -32767})
+        if enc:
+            encoding[nm] = enc
+    return encoding
+
+
+# ----------------------------------------------------------------------
+def save_nc(filename, *args, **kwargs):
+    """Save xray.DataArray variables to a netcdf file.
+
+    Call Signatures
+    ---------------
+    save_nc(filename, var1)
+    save_nc(filename, var1, var2)
+    save_nc(filename, var1, var2, var3)
+    etc...
+
+    Parameters
+    ----------
+    filename : string
+        File path for saving.
+    var1, var2, ... : xray.DataArrays
+        List of xray.DataArrays with compatible coordinates.
+    complevel, shuffle, chunks, pack : optional keyword arguments
+        Compression, chunking and packing options.  See nc_encoding().
+    encoding : dict, optional keyword argument
+        Additional encoding for to_netcdf(), overriding the above.
+    append_dim : str, optional keyword argument
+        If provided and filename exists, append the data to it along
+        this dimension (e.g. to write a derived field incrementally,
+        one time chunk at a time).  If filename doesn't exist, it is
+        created with append_dim as an unlimited dimension.
+    background : bool, optional keyword argument
+        If True, write the file in a background thread and return a
+        concurrent.futures.Future, so that computation can continue.
+        Files are written one at a time in the order submitted.  Call
+        .result() on the Future to wait for the file (and raise any
+        error from writing it).  The input variables shouldn't be
+        modified until then.
+
+    If filename is a Zarr store (see is_zarr()), the data is saved as
+    a Zarr directory store instead of netCDF.  Chunking and packing
+    options apply as above, and the data is compressed with Zarr's
+    default compressor.
+
+    Returns
+    -------
+    future : concurrent.futures.Future or None
+        If background is True, the Future for the write, else None.
+    """
+    options = {'complevel' : None, 'shuffle' : True, 'chunks' : None,
+               'pack' : False, 'encoding' : None, 'append_dim' : None,
+               'background' : False}
+    for key in kwargs:
+        if key not in options:
+            raise TypeError('Invalid keyword argument %s' % key)
+    options.update(kwargs)
+
+    ds = xr.vars_to_dataset(*args)
+    encoding = nc_encoding(ds, options['complevel'], options['shuffle'],
+                           options['chunks'], options['pack'])
+    if options['encoding'] is not None:
+        for nm, enc in options['encoding'].items():
+            encoding[nm] = dict(encoding.get(nm, {}), **enc)
+
+    append_dim = options['append_dim']
+    if append_dim is not None:
+        # Check for the file when writing, after any earlier background
+        # writes to it have finished
+        write = lambda: _write_append(filename, ds, append_dim,
+                                      not os.path.exists(filename), encoding)
+    elif is_zarr(filename):
+        write = lambda: ds.to_zarr(filename, mode='w',
+                                   encoding=_zarr_encoding(encoding))
+    else:
+        write = lambda: ds.to_netcdf(filename, encoding=encoding)
+
+    if options['background']:
+        global _nc_writer
+        if _nc_writer is None:
+            _nc_writer = ThreadPoolExecutor(max_workers=1)
+        return _nc_writer.submit(write)
+    write()
+    return None
+
+
+# ----------------------------------------------------------------------
+class RunningStats:
+    def __init__(self, nms=None):
+        """Return a RunningStats object for single-pass statistics.
+
+        Each call to update() adds one sample (e.g. one year) at every
+        grid point of each variable.  The mean and variance are updated
+        in place in float64 with Welford's algorithm, and partial
+        statistics from separate groups of samples can be combined with
+        merge() (Chan et al.'s pairwise update).  NaNs are skipped, so
+        a missing value in one sample only reduces the count at that
+        grid point.
+
+        Parameters
+        ----------
+        nms : list of str, optional
+            Data variables to include.  If None, then all data variables
+            of the first Dataset passed to update() are included.
+
+        Returns
+        -------
+        self : RunningStats object
+            The RunningStats object has the following data attributes:
+              nms : list of str
+                Names of data variables.
+              count, mean, m2, min, max : dict of ndarrays
+                Number of valid samples, running mean, sum of squared
+                deviations from the mean, minimum and maximum of each
+                variable.  None until the first update().
+
+            And it has the following methods:
+              update() : Add a sample.
+              merge() : Combine with another RunningStats object.
+              result() : Return the statistics as xray.Datasets.
+        """
+        if nms is not None:
+            nms = utils.makelist(nms)
+        self.nms = nms
+        self.count, self.mean, self.m2 = None, None, None
+        self.min, self.max = None, None
+        self._meta = None
+
+    def __repr__(self):
+        s = 'RunningStats\n'
+        if self.count is None:
+            return s + '  No samples\n'
+        for nm in self.nms:
+            s = s + '  %s %s, max count %d\n' % (nm.ljust(10),
+                                                 str(self.mean[nm].shape),
+                                                 self.count[nm].max())
+        return s
+
+    def _init(self, ds):
+        """Allocate accumulators and save metadata from Dataset ds."""
+        if self.nms is None:
+            self.nms = list(ds.data_vars)
+        self._meta = {'coords' : ds[self.nms].coords.to_dataset(),
+                      'attrs' : ds.attrs}
+        self.count, self.mean, self.m2 = {}, {}, {}
+        self.min, self.max = {}, {}
+        for nm in self.nms:
+            shape = ds[nm].shape
+            self._meta[nm] = (ds[nm].dims, ds[nm].attrs)
+            self.count[nm] = np.zeros(shape, dtype=np.int64)
+            self.mean[nm] = np.zeros(shape, dtype=np.float64)
+            self.m2[nm] = np.zeros(shape, dtype=np.float64)
+            self.min[nm] = np.full(shape, np.inf)
+            self.max[nm] = np.full(shape, -np.inf)
+
+    def update(self, ds):
+        """Add the data in Dataset ds as one sample."""
+        if self.count is None:
+            self._init(ds)
+        for nm in self.nms:
+            vals = np.array(ds[nm].values, dtype=np.float64)
+            mean = self.mean[nm]
+            if vals.shape != mean.shape:
+                raise ValueError('Shape %s of %s does not match %s' %
+                                 (str(vals.shape), nm, str(mean.shape)))
+            valid = ~np.isnan(vals)
+            self.count[nm] += valid
+            np.fmin(self.min[nm], vals, out=self.min[nm])
+            np.fmax(self.max[nm], vals, out=self.max[nm])
+            # Setting missing values equal to the mean leaves the mean
+            # and m2 unchanged at those points
+            np.copyto(vals, mean, where=~valid)
+            delta = vals - mean
+            mean += delta / np.maximum(self.count[nm], 1)
+            vals -= mean
+            delta *= vals
+            self.m2[nm] += delta
+
+    def merge(self, other):
+        """Combine with the statistics of another RunningStats object."""
+        if other.count is None:
+            return
+        if self.count is None:
+            self.nms, self._meta = other.nms, other._meta
+            self.count, self.mean, self.m2 = {}, {}, {}
+            self.min, self.max = {}, {}
+            for nm in self.nms:
+                self.count[nm] = other.count[nm].copy()
+                self.mean[nm] = other.mean[nm].copy()
+                self.m2[nm] = other.m2[nm].copy()
+                self.min[nm] = other.min[nm].copy()
+                self.max[nm] = other.max[nm].copy()
+            return
+        for nm in self.nms:
+            na, nb = self.count[nm], other.count[nm]
+            n = na + nb
+            nmax = np.maximum(n, 1)
+            delta = other.mean[nm] - self.mean[nm]
+            self.mean[nm] += delta * nb / nmax
+            self.m2[nm] += other.m2[nm] + delta**2 * na * nb / nmax
+            self.count[nm] = n
+            np.fmin(self.min[nm], other.min[nm], out=self.min[nm])
+            np.fmax(self.max[nm], other.max[nm], out=self.max[nm])
+
+    def result(self, stats='mean', ddof=0):
+        """Return statistics accumulated so far.
+
+        Parameters
+        ----------
+        stats : str or list of str, optional
+            Statistics to return, from 'mean', 'var', 'std', 'min',
+            'max' and 'count'.
+        ddof : int, optional
+            Delta degrees of freedom for 'var' and 'std'.
+
+        Returns
+        -------
+        ds_out : xray.Dataset or dict of xray.Datasets
+            If stats is a str, a Dataset of that statistic for each
+            variable.  Otherwise a dict of Datasets keyed by statistic.
+            Grid points with no valid samples are NaN (count is 0).
+        """
+        if self.count is None:
+            raise ValueError('No samples in RunningStats object')
+        output = {}
+        for stat in utils.makelist(stats):
+            ds_out = xray.Dataset(coords=self._meta['coords'],
+                                  attrs=self._meta['attrs'])
+            for nm in self.nms:
+                count = self.count[nm]
+                if stat == 'count':
+                    vals = count.copy()
+                elif stat == 'mean':
+                    vals = np.where(count > 0, self.mean[nm], np.nan)
+                elif stat in ['var', 'std']:
+                    n = count - ddof
+                    vals = np.where(n > 0, self.m2[nm] / np.maximum(n, 1),
+                                    np.nan)
+                    if stat == 'std':
+                        vals = np.sqrt(vals)
+                elif stat in ['min', 'max']:
+                    vals = getattr(self, stat)[nm]
+                    vals = np.where(count > 0, vals, np.nan)
+                else:
+                    raise ValueError('Invalid stat ' + stat)
+                dims, attrs = self._meta[nm]
+                ds_out[nm] = xray.DataArray(vals, dims=dims,
+                                            coords=self._meta['coords'],
+                                            attrs=attrs)
+            output[stat] = ds_out
+        if isinstance(stats, str):
+            return output[stats]
+        return output
+
+
+# ----------------------------------------------------------------------
+def _file_stats(files, nms, verbose=True):
+    """Return RunningStats for a list of files (for mean_over_files)."""
+    stats = RunningStats(nms)
+    for filenm in files:
+        print_if('Reading ' + filenm, verbose)
+        with _open_dataset(filenm) as ds:
+            stats.update(ds)
+    return stats
 
 
 # ----------------------------------------------------------------------
-def mean_over_files(files, nms=None):
+def mean_over_files(files, nms=None, stats='mean', ddof=0, processes=None,
+                    verbose=True):
     """Return data averaged over all input files.
 
+    The files are read one at a time and the statistics accumulated in
+    a single pass (see RunningStats).  Missing values are skipped, so
+    the mean at each grid point is over the files with valid data there.
+
     Parameters
     ----------
     files : list of str
@@ -794,31 +1844,40 @@ def mean_over_files(files, nms=None):
     nms : list of str, optional
         Subset of data variables to include.  If None, then all data
         variables are included.
+    stats : str or list of str, optional
+        Statistics to compute, from 'mean', 'var', 'std', 'min', 'max'
+        and 'count' (number of files with valid data at each point).
+    ddof : int, optional
+        Delta degrees of freedom for 'var' and 'std'.
+    processes : int, optional
+        If provided, split the files into this many groups and reduce
+        each group in a separate process, then merge the results.
+    verbose : bool, optional
+        If True, print the name of each file as it is read.
 
     Returns
     -------
-    ds_out : xray.Dataset
-        Dataset of variables averaged over all the input files.
+    ds_out : xray.Dataset or dict of xray.Datasets
+        If stats is a str, a Dataset of variables averaged (or other
+        statistic) over all the input files.  If stats is a list, a
+        dict of Datasets keyed by statistic.
     """
+    files = utils.makelist(files)
+    if processes is None or processes <= 1 or len(files) < 2:
+        allstats = _file_stats(files, nms, verbose)
+    else:
+        groups = np.array_split(np.arange(len(files)),
+                                min(processes, len(files)))
+        groups = [[files[i] for i in group] for group in groups]
+        with ProcessPoolExecutor(max_workers=len(groups)) as executor:
+            partial = list(executor.map(_file_stats, groups,
+                                        [nms] * len(groups),
+                                        [verbose] * len(groups)))
+        allstats = RunningStats(nms)
+        for part in partial:
+            allstats.merge(part)
 
-    # Initialize with first file
-    print('Reading ' + files[0])
-    with xray.open_dataset(files[0]) as ds:
-        if nms is None:
-            nms = ds.data_vars.keys()
-        ds_out = ds[nms].load()
-
-    # Sum the variables from each subsequent file
-    for i, filenm in enumerate(files[1:]):
-        print('Reading ' + filenm)
-        with xray.open_dataset(filenm) as ds:
-            ds_out = ds_out + ds[nms]
-            ds_out.load()
-
-    # Divide by number of files for mean
-    ds_out = ds_out / float(len(files))
-
-    return ds_out
+    return allstats.result(stats, ddof)
 
 
 # ======================================================================
@@ -830,10 +1889,10 @@ def latlon_equal(data1, data2, latname1=None, lonname1=None,
                  latname2=None, lonname2=None):
     """Return True if input DataArrays have the same lat-lon coordinates."""
 
-    lat1 = get_coord(data1, 'lat', coord_name=latname1)
-    lon1 = get_coord(data1, 'lon', coord_name=lonname1)
-    lat2 = get_coord(data2, 'lat', coord_name=latname2)
-    lon2 = get_coord(data2, 'lon', coord_name=lonname2)
+    lat1 = get_coord(data1, latname1 or 'lat')
+    lon1 = get_coord(data1, lonname1 or 'lon')
+    lat2 = get_coord(data2, latname2 or 'lat')
+    lon2 = get_coord(data2, lonname2 or 'lon')
 
     is_equal = np.array_equal(lat1, lat2) and np.array_equal(lon1, lon2)
     return is_equal
@@ -853,21 +1912,46 @@ def lon_convention(lon):
 
 
 # ----------------------------------------------------------------------
-def set_lon(data, lonmax=360, lon=None, lonname=None):
+def lon_periodic(lon):
+    """Return True if longitudes lon span the full 360 degrees.
+
+    The longitudes are periodic if the gap between the last and first
+    longitude (wrapping around) matches the typical grid spacing, as
+    on a global grid.  The output of this function can be used for
+    the period argument of gradient().
+    """
+    lon = np.sort(np.asarray(lon, dtype=np.float64))
+    if len(lon) < 2:
+        return False
+    gap = lon[0] + 360 - lon[-1]
+    return bool(np.isclose(gap, np.median(np.diff(lon)), rtol=1e-3))
+
+
+# ----------------------------------------------------------------------
+def set_lon(data, lonmax=360, lon=None, lonname=None, axis=-1):
     """Set data longitudes to 0-360E or 180W-180E convention.
 
+    The longitudes are rotated so that they start at the first grid
+    point at or east of the new minimum longitude.  If the data is
+    already in the selected convention, it is returned without copying.
+    For a DataArray, the rotation is done with isel(), so data read
+    lazily from a file stays unloaded until it is used.
+
     Parameters
     ----------
     data : ndarray or xray.DataArray
-        Input data array with longitude as the last dimension
+        Input data array.
     lonmax : int, optional
         Maximum longitude for output data.  Set to 360 for 0-360E,
         or set to 180 for 180W-180E.
     lon : 1-D ndarray or list, optional
-        Longitudes of input data. Only used if data is an ndarray.
-        If data is an xray.DataArray, then lon = data['lon']
+        Longitudes of input data, in increasing order. Only used if
+        data is an ndarray.  If data is an xray.DataArray, then
+        lon = data['lon']
     lonname : string, optional
         Name of longitude coordinate in data, if data is a DataArray
+    axis : int, optional
+        Longitude axis of data, if data is an ndarray.
 
     Returns
     -------
@@ -882,13 +1966,11 @@ def set_lon(data, lonmax=360, lon=None, lonname=None):
     """
 
     if isinstance(data, xray.DataArray):
-        lon = get_coord(data, 'lon')
         if lonname is None:
             lonname = get_coord(data, 'lon', 'name')
-        name, attrs, coords, dims_list = xr.meta(data)
-        vals = data.values
+        lon = data[lonname].values
     else:
-        vals = data
+        lon = np.asarray(lon)
 
     lonmin = lonmax - 360
     if lonmin >= lon.min() and lonmin <= lon.max():
@@ -898,17 +1980,406 @@ def set_lon(data, lonmax=360, lon=None, lonname=None):
         lon0 = lonmax
         start = False
 
-    vals_out, lon_out = basemap.shiftgrid(lon0, vals, lon, start=start)
+    # Split point, and whether the last longitude repeats the first
+    n = len(lon)
+    i0 = int(np.searchsorted(lon, lon0))
+    if abs(lon[-1] - lon[0] - 360) > 1e-4:
+        start_idx = 0
+    else:
+        start_idx = 1
+
+    if start:
+        lon_out = np.concatenate([lon[i0:], lon[start_idx:i0 + start_idx]
+                                  + 360])
+    else:
+        lon_out = np.concatenate([lon[i0:] - 360,
+                                  lon[start_idx:i0 + start_idx]])
 
     if isinstance(data, xray.DataArray):
-        coords[lonname].values = lon_out
-        data_out = xray.DataArray(vals_out, name=name, dims=dims_list,
-                                  coords=coords, attrs=attrs)
+        if i0 == 0 or i0 == n:
+            data_out = data
+        else:
+            ind = np.concatenate([np.arange(i0, n),
+                                  np.arange(start_idx, i0 + start_idx)])
+            data_out = data.isel(**{lonname : ind})
+        if not np.array_equal(lon_out, lon):
+            lon_out = (lonname, lon_out, data[lonname].attrs)
+            data_out = data_out.assign_coords(**{lonname : lon_out})
         return data_out
     else:
+        if i0 == 0 or i0 == n:
+            vals_out = data
+        elif start_idx == 0:
+            vals_out = np.roll(data, n - i0, axis=axis)
+        else:
+            vals_out = np.concatenate(
+                [np.take(data, range(i0, n), axis=axis),
+                 np.take(data, range(start_idx, i0 + start_idx), axis=axis)],
+                axis=axis)
         return vals_out, lon_out
 
 
+# ----------------------------------------------------------------------
+def _interp_weights_1d(x_in, x_out, periodic=False):
+    """Return bracketing indices and weights for 1-D linear interpolation.
+
+    Parameters
+    ----------
+    x_in : 1-D ndarray
+        Input grid, strictly increasing or strictly decreasing.
+    x_out : 1-D ndarray
+        Points to interpolate onto.
+    periodic : bool, optional
+        If True, x_in is a longitude grid spanning 360 degrees and
+        x_out is wrapped onto it.
+
+    Returns
+    -------
+    i0, i1 : ndarray of ints
+        Indices into x_in of the points bracketing each x_out.
+    w1 : ndarray
+        Weight of x_in[i1] (the weight of x_in[i0] is 1 - w1).  Points
+        outside x_in are clipped to the boundary values.
+    outside : ndarray of bools
+        True for each x_out outside the range of x_in.
+    """
+
+    x_in = np.asarray(x_in, dtype=np.float64)
+    x_out = np.asarray(x_out, dtype=np.float64)
+    n = len(x_in)
+
+    # Work with the ascending order of x_in and map indices back at the
+    # end, so that decreasing grids don't need to be flipped
+    if n > 1 and x_in[0] > x_in[-1]:
+        order = np.arange(n)[::-1]
+    else:
+        order = np.arange(n)
+    xs = x_in[order]
+
+    if n == 1:
+        zeros = np.zeros(len(x_out), dtype=int)
+        return zeros, zeros, np.zeros(len(x_out)), x_out != xs[0]
+
+    if periodic:
+        x = xs[0] + np.mod(x_out - xs[0], 360)
+        xs_ext = np.append(xs, xs[0] + 360)
+        j = np.clip(np.searchsorted(xs_ext, x, side='right') - 1, 0, n - 1)
+        w1 = (x - xs_ext[j]) / (xs_ext[j + 1] - xs_ext[j])
+        j1 = np.mod(j + 1, n)
+        outside = np.zeros(len(x_out), dtype=bool)
+    else:
+        j = np.clip(np.searchsorted(xs, x_out, side='right') - 1, 0, n - 2)
+        w1 = np.clip((x_out - xs[j]) / (xs[j + 1] - xs[j]), 0, 1)
+        j1 = j + 1
+        outside = (x_out < xs[0]) | (x_out > xs[-1])
+
+    return order[j], order[j1], w1, outside
+
+
+# ----------------------------------------------------------------------
+def _cell_bounds(x, lims=None):
+    """Return lower and upper cell bounds for 1-D grid cell centers x.
+
+    Bounds are placed midway between adjacent centers, with the outer
+    bounds extended by half a grid spacing and clipped to lims, if given.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    if len(x) < 2:
+        raise ValueError('At least 2 grid points are needed for cell bounds')
+    edges = np.concatenate(([1.5 * x[0] - 0.5 * x[1]], 0.5 * (x[1:] + x[:-1]),
+                            [1.5 * x[-1] - 0.5 * x[-2]]))
+    if lims is not None:
+        edges = np.clip(edges, lims[0], lims[1])
+    lower = np.minimum(edges[:-1], edges[1:])
+    upper = np.maximum(edges[:-1], edges[1:])
+    return lower, upper
+
+
+# ----------------------------------------------------------------------
+def _overlap_1d(lower_out, upper_out, lower_in, upper_in, shifts=[0]):
+    """Return matrix of overlap lengths between output and input cells.
+
+    Input cells are also shifted by each value in shifts (e.g. -360, 0
+    and 360 for longitudes) so that overlaps across the date line are
+    included.
+    """
+    overlap = np.zeros((len(lower_out), len(lower_in)), dtype=np.float64)
+    for shift in shifts:
+        lo = np.maximum(lower_out[:, None], lower_in[None, :] + shift)
+        hi = np.minimum(upper_out[:, None], upper_in[None, :] + shift)
+        overlap += np.maximum(hi - lo, 0)
+    return overlap
+
+
+# ----------------------------------------------------------------------
+class Regridder:
+    def __init__(self, lat_in, lon_in, lat_out, lon_out, method='bilinear',
+                 filename=None):
+        """Return a Regridder object for interpolating between lat-lon grids.
+
+        The interpolation weights are computed once, as a sparse matrix
+        mapping the input grid to the output grid, and then applied to
+        any number of fields with a single sparse-dense product.
+
+        The 'conservative' method is first-order conservative remapping:
+        each output cell is the area-weighted mean of the input cells
+        overlapping it, so area integrals are preserved.  Cell bounds are
+        placed midway between grid points.  Since lat-lon cells are
+        bounded by parallels and meridians, the overlap areas factor into
+        a latitude part (in sin(lat)) and a longitude part, and the
+        weights matrix is their sparse Kronecker product.
+
+        Parameters
+        ----------
+        lat_in, lon_in : 1-D float array
+            Latitude and longitude of input grid.  Latitudes can be
+            increasing or decreasing.  If lon_in spans 360 degrees, it is
+            treated as periodic and output longitudes are wrapped onto it.
+        lat_out, lon_out : 1-D float array
+            Latitude and longitude to interpolate onto.
+        method : {'bilinear', 'nearest', 'conservative'}, optional
+            Interpolation method.
+        filename : str, optional
+            File (.npz) for storing the weights.  If the file exists and
+            was saved for the same grids and method, the weights are read
+            from it, otherwise they are computed and saved to it.
+
+        Returns
+        -------
+        self : Regridder object
+            The Regridder object has the following data attributes:
+              lat_in, lon_in, lat_out, lon_out : ndarray
+                Input and output grids.
+              method : str
+                Interpolation method.
+              weights : scipy.sparse.csr_matrix
+                Weights matrix of shape (nlat_out * nlon_out,
+                nlat_in * nlon_in).
+              outside : ndarray of bools
+                Output grid points (nlat_out, nlon_out) lying outside the
+                input grid, whose values are clipped to the boundary
+                (or set to NaN for the conservative method).
+
+            And it has the following methods:
+              regrid() : Interpolate data onto the output grid.
+              save() : Save the weights to a file.
+        """
+
+        self.lat_in = np.asarray(lat_in, dtype=np.float64)
+        self.lon_in = np.asarray(lon_in, dtype=np.float64)
+        self.lat_out = np.asarray(lat_out, dtype=np.float64)
+        self.lon_out = np.asarray(lon_out, dtype=np.float64)
+        self.method = method
+        self.shape_in = (len(self.lat_in), len(self.lon_in))
+        self.shape_out = (len(self.lat_out), len(self.lon_out))
+
+        if filename is not None and os.path.exists(filename):
+            loaded = self._load_weights(filename)
+        else:
+            loaded = False
+        if not loaded:
+            self.weights, self.outside = self._calc_weights()
+            if filename is not None:
+                self.save(filename)
+
+    def __repr__(self):
+        s = 'Regridder (%s)\n' % self.method
+        s = s + '  Input grid: %d lat x %d lon\n' % self.shape_in
+        s = s + '  Output grid: %d lat x %d lon\n' % self.shape_out
+        s = s + '  Weights: %d nonzero\n' % self.weights.nnz
+        return s
+
+    def _calc_weights(self):
+        """Return sparse weights matrix and out-of-bounds mask."""
+        if self.method == 'conservative':
+            return self._calc_weights_conservative()
+        if self.method not in ['bilinear', 'nearest']:
+            raise ValueError('Invalid method ' + str(self.method))
+
+        periodic = lon_periodic(self.lon_in)
+        iy0, iy1, wy, yout = _interp_weights_1d(self.lat_in, self.lat_out)
+        ix0, ix1, wx, xout = _interp_weights_1d(self.lon_in, self.lon_out,
+                                                periodic)
+        if self.method == 'nearest':
+            wy, wx = np.round(wy), np.round(wx)
+
+        # Four corners of each output point, on the (lat, lon) output grid
+        nlon_in = self.shape_in[1]
+        rows, cols, vals = [], [], []
+        iout = np.arange(np.prod(self.shape_out)).reshape(self.shape_out)
+        for iy, wty in [(iy0, 1 - wy), (iy1, wy)]:
+            for ix, wtx in [(ix0, 1 - wx), (ix1, wx)]:
+                rows.append(iout.ravel())
+                cols.append((iy[:, None] * nlon_in + ix[None, :]).ravel())
+                vals.append((wty[:, None] * wtx[None, :]).ravel())
+
+        nout, nin = np.prod(self.shape_out), np.prod(self.shape_in)
+        weights = scipy.sparse.coo_matrix(
+            (np.concatenate(vals), (np.concatenate(rows),
+                                    np.concatenate(cols))),
+            shape=(nout, nin)).tocsr()
+        weights.eliminate_zeros()
+        outside = yout[:, None] | xout[None, :]
+
+        return weights, outside
+
+    def _calc_weights_conservative(self):
+        """Return area-overlap weights matrix and uncovered-cell mask."""
+
+        # Overlap areas (up to a factor R^2) are the product of the
+        # overlap in sin(lat) and the overlap in lon (radians)
+        lat_lims = (-90, 90)
+        lat_out1, lat_out2 = _cell_bounds(self.lat_out, lat_lims)
+        lat_in1, lat_in2 = _cell_bounds(self.lat_in, lat_lims)
+        wlat = _overlap_1d(np.sin(np.radians(lat_out1)),
+                           np.sin(np.radians(lat_out2)),
+                           np.sin(np.radians(lat_in1)),
+                           np.sin(np.radians(lat_in2)))
+        lon_out1, lon_out2 = _cell_bounds(self.lon_out)
+        lon_in1, lon_in2 = _cell_bounds(self.lon_in)
+        wlon = _overlap_1d(lon_out1, lon_out2, lon_in1, lon_in2,
+                           shifts=[-360, 0, 360])
+
+        # Normalize by the area of each output cell covered by input cells
+        def normalize(w):
+            total = w.sum(axis=1)
+            covered = total > 0
+            w[covered] = w[covered] / total[covered, None]
+            return scipy.sparse.csr_matrix(w), covered
+
+        wlat, ycovered = normalize(wlat)
+        wlon, xcovered = normalize(wlon)
+        weights = scipy.sparse.kron(wlat, wlon, format='csr')
+        outside = ~(ycovered[:, None] & xcovered[None, :])
+
+        return weights, outside
+
+    def _load_weights(self, filename):
+        """Read weights from file, if saved for the same grids and method."""
+        with np.load(filename) as f:
+            match = (str(f['method']) == self.method and
+                     np.array_equal(f['lat_in'], self.lat_in) and
+                     np.array_equal(f['lon_in'], self.lon_in) and
+                     np.array_equal(f['lat_out'], self.lat_out) and
+                     np.array_equal(f['lon_out'], self.lon_out))
+            if match:
+                self.weights = scipy.sparse.csr_matrix(
+                    (f['data'], f['indices'], f['indptr']),
+                    shape=tuple(f['shape']))
+                self.outside = f['outside']
+        return match
+
+    def save(self, filename):
+        """Save the grids and weights to a .npz file."""
+        w = self.weights
+        with open(filename, 'wb') as f:
+            np.savez(f, method=self.method, lat_in=self.lat_in,
+                     lon_in=self.lon_in, lat_out=self.lat_out,
+                     lon_out=self.lon_out, data=w.data, indices=w.indices,
+                     indptr=w.indptr, shape=w.shape, outside=self.outside)
+
+    @classmethod
+    def load(cls, filename):
+        """Return a Regridder with the grids and weights saved in a file."""
+        with np.load(filename) as f:
+            grids = [f[nm] for nm in ['lat_in', 'lon_in', 'lat_out',
+                                      'lon_out']]
+            method = str(f['method'])
+        return cls(*grids, method=method, filename=filename)
+
+    def regrid(self, data, checkbounds=False, masked=False):
+        """Interpolate data onto the output grid.
+
+        Parameters
+        ----------
+        data : ndarray or xray.DataArray
+            Data on the input grid, with latitude as second-last
+            dimension, longitude as last dimension and any number of
+            leading dimensions.
+        checkbounds : bool, optional
+            If True, raise a ValueError if any output grid points lie
+            outside the input grid.
+        masked : bool or float, optional
+            If True, points outside the input grid are set to NaN.  If
+            masked is set to a number, then points outside the input grid
+            are set to that number.  Otherwise they are clipped to the
+            values on the boundary of the input grid (bilinear and
+            nearest methods) or set to NaN (conservative method).
+
+        With the conservative method, NaNs in the input are excluded
+        and each output cell is the mean over its non-NaN overlapping
+        input area.  With the other methods, NaNs propagate to any
+        output point that depends on them.
+
+        Returns
+        -------
+        data_out : ndarray or xray.DataArray
+            Data interpolated onto the output grid.
+        """
+
+        if checkbounds and self.outside.any():
+            raise ValueError('Output lat-lon grid is outside the range of '
+                             'the input grid.')
+
+        if isinstance(data, xray.DataArray):
+            latname = get_coord(data, 'lat', 'name')
+            lonname = get_coord(data, 'lon', 'name')
+            if (not np.allclose(data[latname].values, self.lat_in) or
+                not np.allclose(data[lonname].values, self.lon_in)):
+                raise ValueError('Data lat-lon grid does not match Regridder '
+                                 'input grid.')
+            name, attrs, coords, dims_list = xr.meta(data)
+            coords[latname] = xray.DataArray(
+                self.lat_out, coords={latname : self.lat_out}, dims=[latname],
+                attrs=data[latname].attrs)
+            coords[lonname] = xray.DataArray(
+                self.lon_out, coords={lonname : self.lon_out}, dims=[lonname],
+                attrs=data[lonname].attrs)
+            vals = data.values
+        else:
+            vals = np.asarray(data)
+
+        if vals.shape[-2:] != self.shape_in:
+            raise ValueError('Data lat-lon dimensions %s do not match input '
+                             'grid %s' % (str(vals.shape[-2:]),
+                                          str(self.shape_in)))
+
+        # Stack all leading dimensions and apply the weights in one product
+        dims = vals.shape[:-2]
+        if np.issubdtype(vals.dtype, np.floating):
+            weights = self.weights.astype(vals.dtype)
+        else:
+            weights = self.weights
+        vals_in = vals.reshape((-1, np.prod(self.shape_in)))
+        missing = np.isnan(vals_in)
+        if self.method == 'conservative' and missing.any():
+            # Renormalize by the non-missing area of each output cell
+            vals_out = weights.dot(np.where(missing, 0, vals_in).T).T
+            area = weights.dot((~missing).T.astype(weights.dtype)).T
+            with np.errstate(invalid='ignore', divide='ignore'):
+                vals_out = vals_out / area
+        else:
+            vals_out = weights.dot(vals_in.T).T
+        vals_out = vals_out.reshape(dims + self.shape_out)
+
+        if masked is not False:
+            fill = np.nan if masked is True else masked
+        elif self.method == 'conservative':
+            fill = np.nan
+        else:
+            fill = None
+        if fill is not None and self.outside.any():
+            vals_out[..., self.outside] = fill
+
+        if isinstance(data, xray.DataArray):
+            data_out = xray.DataArray(vals_out, name=name, coords=coords,
+                                      dims=dims_list, attrs=attrs)
+        else:
+            data_out = vals_out
+
+        return data_out
+
+
 # ----------------------------------------------------------------------
 def interp_latlon(data, lat_out, lon_out, lat_in=None, lon_in=None,
                   checkbounds=False, masked=False, order=1):
@@ -918,7 +2389,7 @@ def interp_latlon(data, lat_out, lon_out, lat_in=None, lon_in=None,
     ----------
     data : ndarray or xray.DataArray
         Data to interpolate, with latitude as second-last dimension,
-        longitude as last dimension.  Maximum array dimensions: 5-D.
+        longitude as last dimension.
     lat_out, lon_out : 1-D float or int array
         Latitude and longitudes to interpolate onto.
     lat_in, lon_in : 1-D float or int array, optional
@@ -932,8 +2403,8 @@ def interp_latlon(data, lat_out, lon_out, lat_in=None, lon_in=None,
         interpolated values will be clipped to values on boundary
         of input grid lat_in, lon_in
     masked : bool or float, optional
-        If True, points outside the range of lat_in, lon_in are masked
-        (in a masked array).
+        If True, points outside the range of lat_in, lon_in are set
+        to NaN.
         If masked is set to a number, then points outside the range of
         lat_in, lon_in will be set to that number.
     order : int, optional
@@ -945,8 +2416,28 @@ def interp_latlon(data, lat_out, lon_out, lat_in=None, lon_in=None,
     -------
     data_out : ndarray or xray.DataArray
         Data interpolated onto lat_out, lon_out grid
+
+    Notes
+    -----
+    For order 0 and 1, the interpolation weights are computed with a
+    Regridder object.  To interpolate many fields between the same
+    grids, create a Regridder once and call its regrid() method.  For
+    area-conserving remapping (e.g. of precipitation), use a Regridder
+    with method='conservative'.
     """
 
+    if isinstance(data, xray.DataArray):
+        lat_in = get_coord(data, 'lat')
+        lon_in = get_coord(data, 'lon')
+
+    if order in [0, 1]:
+        method = {0 : 'nearest', 1 : 'bilinear'}[order]
+        regridder = Regridder(lat_in, lon_in, lat_out, lon_out, method)
+        return regridder.regrid(data, checkbounds=checkbounds, masked=masked)
+
+    # Cubic spline interpolation with basemap.interp()
+    from mpl_toolkits import basemap
+
     # Maximum number of dimensions handled by this code
     nmax = 5
     ndim = data.ndim
@@ -955,9 +2446,7 @@ def interp_latlon(data, lat_out, lon_out, lat_in=None, lon_in=None,
         raise ValueError('Input data has too many dimensions. Max 5-D.')
 
     if isinstance(data, xray.DataArray):
-        lat_in = get_coord(data, 'lat')
         latname = get_coord(data, 'lat', 'name')
-        lon_in = get_coord(data, 'lon')
         lonname = get_coord(data, 'lon', 'name')
         name, attrs, coords, dims_list = xr.meta(data)
         coords[latname] = xray.DataArray(lat_out, coords={latname : lat_out},
@@ -1017,16 +2506,180 @@ def interp_latlon(data, lat_out, lon_out, lat_in=None, lon_in=None,
     return data_out
 
 
+# ----------------------------------------------------------------------
+def _grid_hash(*args):
+    """Return a hex digest identifying a set of grid arrays and options."""
+    sha = hashlib.sha1()
+
+    def update(arg):
+        if isinstance(arg, np.ndarray):
+            sha.update(str(arg.dtype).encode('utf-8'))
+            sha.update(str(arg.shape).encode('utf-8'))
+            sha.update(np.ascontiguousarray(arg).tobytes())
+        elif isinstance(arg, (xray.DataArray, xray.Dataset)):
+            sha.update(repr(type(arg)).encode('utf-8'))
+            for nm in sorted(arg.variables):
+                sha.update(repr((nm, arg[nm].dims)).encode('utf-8'))
+                update(np.asarray(arg[nm].values))
+        elif isinstance(arg, (list, tuple)):
+            sha.update(repr(type(arg)).encode('utf-8'))
+            for item in arg:
+                update(item)
+        elif isinstance(arg, dict):
+            sha.update(repr(type(arg)).encode('utf-8'))
+            for key in sorted(arg, key=repr):
+                update(key)
+                update(arg[key])
+        else:
+            sha.update(repr(arg).encode('utf-8'))
+
+    for arg in args:
+        update(arg)
+    return sha.hexdigest()
+
+
+# ----------------------------------------------------------------------
+def _cache_path(subdir, filename):
+    """Return path to a file in CACHE_DIR, creating subdir if necessary."""
+    path = os.path.join(CACHE_DIR, subdir)
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            # Created by another process in the meantime
+            if not os.path.isdir(path):
+                raise
+    return os.path.join(path, filename)
+
+
+# ----------------------------------------------------------------------
+def _save_atomic(filename, savefunc, use_path=False):
+    """Write a file with savefunc(fileobj) via a temporary file and rename.
+
+    The rename is atomic, so parallel readers never see a partly
+    written file.  If use_path is True, savefunc is called with the
+    path of the temporary file instead of an open file object.
+    """
+    tmpfile = '%s.%d.%d.tmp' % (filename, os.getpid(),
+                                threading.current_thread().ident)
+    try:
+        if use_path:
+            savefunc(tmpfile)
+        else:
+            with open(tmpfile, 'wb') as f:
+                savefunc(f)
+        os.rename(tmpfile, filename)
+    finally:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+
+
+# ----------------------------------------------------------------------
+def _cache_evict(subdir, maxsize, keep=None):
+    """Delete least recently used files in CACHE_DIR/subdir.
+
+    Files are deleted, oldest access first, until the total size is
+    no more than maxsize bytes.  Temporary files still being written
+    by _save_atomic and the file named keep (e.g. the entry just
+    written) are never deleted.
+    """
+    path = os.path.join(CACHE_DIR, subdir)
+    if not os.path.isdir(path):
+        return
+    if keep is not None:
+        keep = os.path.abspath(keep)
+    files = []
+    for nm in os.listdir(path):
+        if nm.endswith('.tmp'):
+            continue
+        filename = os.path.join(path, nm)
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            # Deleted by another process in the meantime
+            continue
+        files.append((stat.st_mtime, stat.st_size, filename))
+    total = sum([f[1] for f in files])
+    for _, size, filename in sorted(files):
+        if total <= maxsize:
+            break
+        if os.path.abspath(filename) == keep:
+            continue
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+        total -= size
+
+
+# ----------------------------------------------------------------------
+def land_mask(lat, lon, inlands=True, resolution='l', grid=5, cache=True):
+    """Return a boolean land/sea mask on a lat-lon grid.
+
+    Masks are kept in memory for the rest of the session and, if cache
+    is True, saved in CACHE_DIR so that each grid and set of options
+    only has to go through basemap.maskoceans once.
+
+    Parameters
+    ----------
+    lat, lon : 1-D float array
+        Latitude and longitude grid.  Longitudes can use either the
+        0-360E or 180W-180E convention.
+    inlands : bool, optional
+        If False, mask only ocean points and not inland lakes.
+    resolution : {'c','l','i','h', 'f'}, optional
+        gshhs coastline resolution used to define land/sea mask.
+    grid : {1.25, 2.5, 5, 10}, optional
+        Land/sea mask grid spacing in minutes.
+    cache : bool, optional
+        If True, read the mask from (or save it to) the on-disk cache.
+
+    Returns
+    -------
+    mask : ndarray of bools
+        Array of shape (len(lat), len(lon)) which is True over land
+        and False over ocean.
+    """
+
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    key = _grid_hash(lat, lon, inlands, resolution, grid)
+    if key in _land_masks:
+        return _land_masks[key]
+
+    if cache:
+        filename = _cache_path('landmask', 'landmask_%s.npy' % key)
+    if cache and os.path.exists(filename):
+        mask = np.load(filename)
+    else:
+        # Basemap is slow to import, so only import it when needed
+        from mpl_toolkits import basemap
+
+        # basemap.maskoceans looks up each point individually, so the
+        # longitudes can be wrapped to 180W-180E without reordering
+        lon180 = np.mod(lon + 180, 360) - 180
+        x, y = np.meshgrid(lon180, lat)
+        ocean = basemap.maskoceans(x, y, np.ones(x.shape), inlands=inlands,
+                                   resolution=resolution, grid=grid)
+        mask = ~np.ma.getmaskarray(ocean)
+        if cache:
+            _save_atomic(filename, lambda f: np.save(f, mask))
+
+    mask.flags.writeable = False
+    _land_masks[key] = mask
+    return mask
+
+
 # ----------------------------------------------------------------------
 def mask_oceans(data, lat=None, lon=None, inlands=True, resolution='l',
-                grid=5):
+                grid=5, cache=True):
     """Return the data with ocean grid points set to NaN.
 
     Parameters
     ----------
     data : ndarray or xray.DataArray
         Data to mask, with latitude as second-last dimension,
-        longitude as last dimension.  Maximum array dimensions: 5-D.
+        longitude as last dimension.
     lat, lon : ndarray, optional
         Latitude and longitude arrays.  Only used if data is an
         ndarray and not an xray.DataArray.
@@ -1036,6 +2689,9 @@ def mask_oceans(data, lat=None, lon=None, inlands=True, resolution='l',
         gshhs coastline resolution used to define land/sea mask.
     grid : {1.25, 2.5, 5, 10}, optional
         Land/sea mask grid spacing in minutes.
+    cache : bool, optional
+        If True, use the on-disk cache of land/sea masks.  See
+        land_mask() for details.
 
     Returns
     -------
@@ -1043,54 +2699,17 @@ def mask_oceans(data, lat=None, lon=None, inlands=True, resolution='l',
         Data with ocean grid points set to NaN.
     """
 
-    # Maximum number of dimensions handled by this code
-    nmax = 5
-    ndim = data.ndim
-
-    if ndim > 5:
-        raise ValueError('Input data has too many dimensions. Max 5-D.')
-
     if isinstance(data, xray.DataArray):
         lat = get_coord(data, 'lat')
         lon = get_coord(data, 'lon')
         name, attrs, coords, dims_list = xr.meta(data)
-        vals = data.values.copy()
+        vals = data.values
     else:
         vals = data
 
-    # Convert to 180W-180E convention that basemap.maskoceans requires
-    lonmax = lon_convention(lon)
-    if lonmax == 360:
-        vals, lon = set_lon(vals, lonmax=180, lon=lon)
-
-    # Add singleton dimensions for looping, if necessary
-    for i in range(ndim, nmax):
-        vals = np.expand_dims(vals, axis=0)
-
-    # Initialize output
-    vals_out = np.ones(vals.shape, dtype=float)
-    vals_out = np.ma.masked_array(vals_out, np.isnan(vals_out))
-
-    # Mask oceans, iterating over additional dimensions
-    x, y = np.meshgrid(lon, lat)
-    dims = vals_out.shape[:-2]
-    for i in range(dims[0]):
-        for j in range(dims[1]):
-            for k in range(dims[2]):
-                vals_out[i, j, k] = basemap.maskoceans(
-                    x, y, vals[i, j, k], inlands=inlands,
-                    resolution=resolution, grid=grid)
-
-    # Convert from masked array to regular array with NaNs
-    vals_out = vals_out.filled(np.nan)
-
-    # Collapse any additional dimensions that were added
-    for i in range(ndim, vals_out.ndim):
-        vals_out = vals_out[0]
-
-    # Convert back to original longitude convention
-    if lonmax == 360:
-        vals_out, lon = set_lon(vals_out, lonmax=lonmax, lon=lon)
+    # Land/sea mask is broadcast over all the leading dimensions
+    mask = land_mask(lat, lon, inlands, resolution, grid, cache)
+    vals_out = np.where(mask, vals, np.nan)
 
     if isinstance(data, xray.DataArray):
         data_out = xray.DataArray(vals_out, name=name, coords=coords,
@@ -1121,7 +2740,8 @@ def mean_over_geobox(data, lat1, lat2, lon1, lon2, lat=None, lon=None,
         Return the area-weighted average (weighted by cos(lat))
     land_only : bool, optional
         Mask out ocean grid points so that only data over land is
-        included in the mean.
+        included in the mean.  Uses the cached land/sea mask from
+        land_mask().
 
     Returns
     -------
@@ -1182,10 +2802,9 @@ def mean_over_geobox(data, lat1, lat2, lon1, lon2, lat=None, lon=None,
         # Array of latitudes with same NaN mask as the data so that the
         # area calculation is correct
         lat_rad = np.radians(get_coord(data_out, 'lat'))
-        lat_rad = biggify(lat_rad, data_out, tile=True)
-        mdat = np.ma.masked_array(data_out, np.isnan(data_out))
-        lat_rad = np.ma.masked_array(lat_rad, mdat.mask)
-        lat_rad = lat_rad.filled(np.nan)
+        lat_rad = biggify(lat_rad, data_out, tile='view',
+                          dims=get_coord(data_out, 'lat', 'name'))
+        lat_rad = np.where(np.isnan(data_out), np.nan, lat_rad)
 
         if area_wtd:
             # Weight by area with cos(lat)
@@ -1205,14 +2824,175 @@ def mean_over_geobox(data, lat1, lat2, lon1, lon2, lat=None, lon=None,
     return avg
 
 
+# ----------------------------------------------------------------------
+def _geoboxes_nan(vals, inlat, inlon, coslat, halfdx, inint, single, lat,
+                  lat1):
+    """Return box means of data with NaNs, as in mean_over_geobox()."""
+
+    # Mean over longitudes for each box, skipping NaNs
+    valid = ~np.isnan(vals)
+    zsum = np.tensordot(np.where(valid, vals, 0), inlon, axes=([-1], [0]))
+    zcount = np.tensordot(valid.astype(float), inlon, axes=([-1], [0]))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        zm = zsum / zcount
+
+    # Trapezoidal integral over latitudes, with each interval included
+    # only if the zonal means at both of its ends are non-NaN
+    zvalid = ~np.isnan(zm)
+    y = np.where(zvalid, zm * coslat[:, None], 0)
+    cw = zvalid * coslat[:, None]
+    pairs = zvalid[..., :-1, :] & zvalid[..., 1:, :]
+    wts = pairs * (halfdx[:, None] * inint)
+    num = (wts * (y[..., :-1, :] + y[..., 1:, :])).sum(axis=-2)
+    area = (wts * (cw[..., :-1, :] + cw[..., 1:, :])).sum(axis=-2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg = np.where(area != 0, num / area, np.nan)
+
+    # Single-latitude boxes are just the zonal mean at that latitude
+    if single.any():
+        ilat = [np.where(lat == lat1[i])[0][0] for i in np.where(single)[0]]
+        avg[..., single] = zm[..., ilat, np.where(single)[0]]
+
+    return avg
+
+
+# ----------------------------------------------------------------------
+def mean_over_geoboxes(data, boxes, lat=None, lon=None, area_wtd=True,
+                       land_only=False, region_name='region'):
+    """Return the means of an array over several lat-lon regions.
+
+    Equivalent to calling mean_over_geobox() for each box, including its
+    handling of NaNs, but all of the boxes are reduced together in one
+    pass over the data.
+
+    Parameters
+    ----------
+    data : ndarray or xray.DataArray
+        Data to average, with latitude as second-last dimension and
+        longitude as last dimension.
+    boxes : dict or list of 4-tuples
+        Averaging regions, each in the form (lat1, lat2, lon1, lon2) with
+        lon1 <= lon2 and lat1 <= lat2.  If a dict (e.g. an OrderedDict),
+        the keys are used as the region names, otherwise the regions are
+        numbered in order.
+    lat, lon : ndarray, optional
+        Latitude and longitude arrays.  Only used if data is an
+        ndarray and not an xray.DataArray.
+    area_wtd : bool, optional
+        Return the area-weighted average (weighted by cos(lat))
+    land_only : bool, optional
+        Mask out ocean grid points so that only data over land is
+        included in the mean.
+    region_name : str, optional
+        Name of the region dimension in the output.
+
+    Returns
+    -------
+    avg : ndarray or xray.DataArray
+        The data averaged over each lat-lon region, with the regions
+        along the first dimension.
+    """
+
+    if isinstance(boxes, dict):
+        names = list(boxes.keys())
+        boxes = [boxes[nm] for nm in names]
+    else:
+        names = list(range(len(boxes)))
+    bounds = np.array(boxes, dtype=np.float64).reshape((-1, 4))
+    lat1, lat2, lon1, lon2 = [bounds[:, i] for i in range(4)]
+
+    if isinstance(data, xray.DataArray):
+        name, attrs, coords, dims = xr.meta(data)
+        latname = get_coord(data, 'lat', 'name')
+        lonname = get_coord(data, 'lon', 'name')
+        lat = get_coord(data, 'lat')
+        lon = get_coord(data, 'lon')
+        coords = utils.odict_delete(coords, latname)
+        coords = utils.odict_delete(coords, lonname)
+        dims = list(dims[:-2])
+    else:
+        if lat is None or lon is None:
+            raise ValueError('Latitude and longitude arrays must be provided '
+                'if data is not an xray.DataArray.')
+        lat, lon = np.asarray(lat), np.asarray(lon)
+
+    if land_only:
+        data = mask_oceans(data, lat, lon)
+    vals = np.asarray(data)
+
+    for i in range(len(bounds)):
+        if lat1[i] == lat2[i] and lat1[i] not in lat:
+            raise ValueError('lat1=lat2=%f not in latitude grid' % lat1[i])
+        if lon1[i] == lon2[i] and lon1[i] not in lon:
+            raise ValueError('lon1=lon2=%f not in longitude grid' % lon1[i])
+
+    # Membership of each grid point in each box, shape (npts, nbox)
+    inlat = ((lat[:, None] >= lat1) & (lat[:, None] <= lat2)).astype(float)
+    inlon = ((lon[:, None] >= lon1) & (lon[:, None] <= lon2)).astype(float)
+    if (inlat.sum(axis=0) == 0).any() or (inlon.sum(axis=0) == 0).any():
+        raise ValueError('No grid points within one or more of the boxes')
+
+    # Trapezoid weights in latitude: interval k lies between lat[k] and
+    # lat[k+1] and is in a box if both of its end points are
+    lat_rad = np.radians(lat)
+    if area_wtd:
+        coslat = np.cos(lat_rad)
+    else:
+        coslat = np.ones(lat.shape)
+    halfdx = np.diff(lat_rad) / 2
+    inint = inlat[:-1] * inlat[1:]
+    single = lat1 == lat2
+
+    valid = ~np.isnan(vals)
+    if valid.all():
+        # No missing data: one normalized area-weight matrix per box,
+        # applied to all boxes with a single tensordot over lat and lon
+        latwts = np.zeros(inlat.shape)
+        latwts[:-1] += halfdx[:, None] * inint
+        latwts[1:] += halfdx[:, None] * inint
+        latwts *= coslat[:, None]
+        for i in np.where(single)[0]:
+            latwts[:, i] = lat == lat1[i]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            latwts /= latwts.sum(axis=0)
+        lonwts = inlon / inlon.sum(axis=0)
+        wts = latwts[:, None, :] * lonwts[None, :, :]
+        avg = np.tensordot(vals, wts, axes=([-2, -1], [0, 1]))
+    else:
+        avg = _geoboxes_nan(vals, inlat, inlon, coslat, halfdx, inint,
+                            single, lat, lat1)
+    avg = np.moveaxis(avg, -1, 0)
+
+    if isinstance(data, xray.DataArray):
+        attrs['description'] = 'Mean over lat-lon subsets'
+        attrs['area_weighted'] = area_wtd
+        attrs['land_only'] = land_only
+        coords_out = collections.OrderedDict()
+        coords_out[region_name] = names
+        for key in coords:
+            coords_out[key] = coords[key]
+        avg = xray.DataArray(avg, name=name, coords=coords_out,
+                             dims=[region_name] + dims, attrs=attrs)
+        for nm, vals in zip(['lat1', 'lat2', 'lon1', 'lon2'],
+                            [lat1, lat2, lon1, lon2]):
+            avg.coords[nm] = (region_name, vals)
+
+    return avg
+
+
 # ======================================================================
 # PRESSURE LEVEL DATA AND TOPOGRAPHY
 # ======================================================================
 
 # ----------------------------------------------------------------------
-def get_ps_clim(lat, lon, datafile='data/topo/ncep2_ps.nc'):
+def get_ps_clim(lat, lon, datafile='data/topo/ncep2_ps.nc', cache=True):
     """Return surface pressure climatology on selected lat-lon grid.
 
+    The interpolated climatology is cached in memory for the most
+    recently used grids, keyed by datafile, its modification time and
+    the lat-lon grid, and (if cache is True) saved in CACHE_DIR so that
+    later sessions and parallel workers can read it from there.
+
     Parameters
     ----------
     lat, lon : 1-D float array
@@ -1220,6 +3000,9 @@ def get_ps_clim(lat, lon, datafile='data/topo/ncep2_ps.nc'):
         climatology onto.
     datafile : string, optional
         Name of file to read for surface pressure climatology.
+    cache : bool, optional
+        If True, read the interpolated climatology from (or save it to)
+        the on-disk cache.
 
     Returns
     -------
@@ -1228,25 +3011,48 @@ def get_ps_clim(lat, lon, datafile='data/topo/ncep2_ps.nc'):
         lat-lon grid.
     """
 
-    ds = ncload(datafile)
-    ps = ds['ps']
-    ps.attrs = utils.odict_insert(ps.attrs, 'title', ds.attrs['title'], pos=0)
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    key = _grid_hash(os.path.abspath(datafile), os.path.getmtime(datafile),
+                     lat, lon)
+    if key in _ps_clims:
+        # Move to the end as the most recently used
+        ps = _ps_clims.pop(key)
+        _ps_clims[key] = ps
+        return ps.copy()
+
+    if cache:
+        filename = _cache_path('ps_clim', 'ps_clim_%s.nc' % key)
+    if cache and os.path.exists(filename):
+        with xray.open_dataarray(filename) as ps:
+            ps.load()
+    else:
+        ds = ncload(datafile, verbose=False)
+        ps = ds['ps']
+        ps.attrs = utils.odict_insert(ps.attrs, 'title', ds.attrs['title'],
+                                      pos=0)
 
-    # Check what longitude convention is used in the surface pressure
-    # climatology and switch if necessary
-    lonmax = lon_convention(lon)
-    lon_ps = get_coord(ps, 'lon')
-    if lon_convention(lon_ps) != lonmax:
-        ps = set_lon(ps, lonmax)
+        # Check what longitude convention is used in the surface pressure
+        # climatology and switch if necessary
+        lonmax = lon_convention(lon)
+        lon_ps = get_coord(ps, 'lon')
+        if lon_convention(lon_ps) != lonmax:
+            ps = set_lon(ps, lonmax)
 
-    # Interpolate ps onto lat-lon grid
-    ps = interp_latlon(ps, lat, lon)
+        # Interpolate ps onto lat-lon grid
+        ps = interp_latlon(ps, lat, lon)
+        if cache:
+            _save_atomic(filename, ps.to_netcdf, use_path=True)
 
-    return ps
+    _ps_clims[key] = ps
+    while len(_ps_clims) > PS_CLIM_MAXGRIDS:
+        _ps_clims.popitem(last=False)
+    return ps.copy()
 
 
 # ----------------------------------------------------------------------
-def correct_for_topography(data, topo_ps, plev=None, lat=None, lon=None):
+def correct_for_topography(data, topo_ps, plev=None, lat=None, lon=None,
+                           inplace=False):
     """Set pressure level data below topography to NaN.
 
     Parameters
@@ -1255,24 +3061,29 @@ def correct_for_topography(data, topo_ps, plev=None, lat=None, lon=None):
         Data to correct, with pressure, latitude, longitude as the
         last three dimensions.
     topo_ps : ndarray or xray.DataArray
-        Climatological surface pressure to use for topography, on same
-        lat-lon grid as data.
+        Surface pressure to use for topography, on same lat-lon grid as
+        data.  Either a climatology (lat, lon) or a time-varying field
+        with the same dimensions as data other than pressure, e.g.
+        (time, lat, lon) for data of shape (time, plev, lat, lon).
     plev, lat, lon : 1-D float array, optional
         Pressure levels, latitudes and longitudes of input data.
         Only used if data is an ndarray. If data is an xray.DataArray
         then plev, lat and lon are extracted from data.coords.
+    inplace : bool, optional
+        If True, set the values in data itself instead of in a copy.
+        The data must then be of a floating point type.
 
     Returns
     -------
     data_out : ndarray or xray.DataArray
-        Data with grid points below topography set to NaN.
+        Data with grid points below topography set to NaN.  If inplace
+        is True, this is the input data object.
     """
 
     if isinstance(data, xray.DataArray):
         lat = get_coord(data, 'lat')
         lon = get_coord(data, 'lon')
-        name, attrs, coords, _ = xr.meta(data)
-        vals = data.values.copy()
+        vals = data.values
         # -- Pressure levels in Pascals
         plev = get_coord(data, 'plev')
         pname = get_coord(data, 'plev', 'name')
@@ -1289,15 +3100,29 @@ def correct_for_topography(data, topo_ps, plev=None, lat=None, lon=None):
         ps_vals = topo_ps.values
         ps_vals = pres_convert(ps_vals, topo_ps.units, 'Pa')
     else:
-        ps_vals = topo_ps
+        ps_vals = np.asarray(topo_ps)
 
-    # For each vertical level, set any point below topography to NaN
-    for k, p in enumerate(plev):
-        ibelow = ps_vals < p
-        vals[...,k,ibelow] = np.nan
+    if inplace:
+        if not np.issubdtype(vals.dtype, np.floating):
+            raise ValueError('Data must be floating point for inplace=True')
+    elif np.issubdtype(vals.dtype, np.floating):
+        vals = vals.copy()
+    else:
+        vals = vals.astype(np.float64)
+
+    # Below-ground mask of shape (..., plev, lat, lon), broadcast against
+    # the data and applied in a single pass
+    plev = np.asarray(plev)
+    below = ps_vals[..., None, :, :] < plev[:, None, None]
+    np.copyto(vals, np.nan, where=below)
 
     if isinstance(data, xray.DataArray):
-        data_out = xray.DataArray(vals, name=name, coords=coords, attrs=attrs)
+        if inplace:
+            data_out = data
+        else:
+            name, attrs, coords, _ = xr.meta(data)
+            data_out = xray.DataArray(vals, name=name, coords=coords,
+                                      attrs=attrs)
     else:
         data_out = vals
 
@@ -1314,9 +3139,8 @@ def near_surface(data, pdim=-3, return_inds=False):
     Parameters
     ----------
     data : ndarray or xray.DataArray
-        Input data, maximum of 5 dimensions.  Pressure levels must
-        be the last, second-last or third-last dimension.
-    pdim : {-3, -2, -1}, optional
+        Input data, with any number of dimensions.
+    pdim : int, optional
         Dimension of vertical levels in data.
     return_inds : bool, optional
         If True, return the pressure-level indices of the extracted
@@ -1329,62 +3153,37 @@ def near_surface(data, pdim=-3, return_inds=False):
         Near-surface data [and indices of extracted data, if
         return_inds is True]. If input data is an xray.DataArray,
         data_s is returned as an xray.DataArray, otherwise as
-        an ndarray.
+        an ndarray.  Grid points where all levels are NaN have
+        data_s set to NaN and ind_s set to -1.
     """
 
-    # Maximum number of dimensions handled by this code
-    nmax = 5
-    ndim = data.ndim
-
-    if ndim > nmax:
-        raise ValueError('Input data has too many dimensions. Max 5-D.')
-
     # Save metadata for output DataArray, if applicable
     if isinstance(data, xray.DataArray):
         i_DataArray = True
-        data = data.copy()
         name, attrs, coords, _ = xr.meta(data)
         title = 'Near-surface data extracted from pressure level data'
         attrs = utils.odict_insert(attrs, 'title', title, pos=0)
         pname = get_coord(data, 'plev', 'name')
         del(coords[pname])
+        vals = data.values
     else:
         i_DataArray = False
-
-    # Add singleton dimensions for looping, if necessary
-    for i in range(ndim, nmax):
-        data = np.expand_dims(data, axis=0)
-
-    # Make sure pdim is indexing from end
-    pdim_in = pdim
-    if pdim > 0:
-        pdim = pdim - nmax
-
-    # Iterate over all other dimensions
-    dims = list(data.shape)
-    dims.pop(pdim)
-    data_s = np.nan*np.ones(dims, dtype=float)
-    ind_s = np.ones(dims, dtype=int)
-    for i in range(dims[0]):
-        for j in range(dims[1]):
-            for k in range(dims[2]):
-                for m in range(dims[3]):
-                    if pdim == -3:
-                        sub = data[i,j,:,k,m]
-                    elif pdim == -2:
-                        sub = data[i,j,k,:,m]
-                    elif pdim == -1:
-                        sub = data[i,j,k,m,:]
-                    else:
-                        raise ValueError('Invalid p dimension ' + str(pdim_in))
-                    ind = np.where(~np.isnan(sub))[0][0]
-                    data_s[i,j,k,m] = sub[ind]
-                    ind_s[i,j,k,m] = ind
-
-    # Collapse any additional dimensions that were added
-    for i in range(ndim - 1, data_s.ndim):
-        data_s = data_s[0]
-        ind_s = ind_s[0]
+        vals = np.asarray(data)
+
+    if pdim < -vals.ndim or pdim >= vals.ndim:
+        raise ValueError('Invalid p dimension ' + str(pdim))
+
+    # Index of the first non-NaN level in every column at once
+    valid = ~np.isnan(vals)
+    ind_s = np.argmax(valid, axis=pdim)
+    allnan = ~np.take_along_axis(valid, np.expand_dims(ind_s, pdim),
+                                 axis=pdim).squeeze(axis=pdim)
+    data_s = np.take_along_axis(vals, np.expand_dims(ind_s, pdim),
+                                axis=pdim).squeeze(axis=pdim)
+    if not np.issubdtype(data_s.dtype, np.floating):
+        data_s = data_s.astype(np.float64)
+    data_s = np.where(allnan, np.nan, data_s).astype(data_s.dtype)
+    ind_s = np.where(allnan, -1, ind_s)
 
     # Pack data_s into an xray.DataArray if input was in that form
     if i_DataArray:
@@ -1398,24 +3197,181 @@ def near_surface(data, pdim=-3, return_inds=False):
 
 
 # ----------------------------------------------------------------------
-def interp_plevels(data, plev_new, plev_in=None, pdim=-3, kind='linear'):
+class PlevInterpolator:
+    def __init__(self, plev_in, plev_new, pdim=-3, kind='linear',
+                 logp=False):
+        """Return a PlevInterpolator for interpolating onto new levels.
+
+        The bracketing level indices and weights are computed once
+        from plev_in and plev_new and can then be applied to any number
+        of variables on the same vertical grid, with all columns
+        interpolated at once.
+
+        Parameters
+        ----------
+        plev_in : ndarray
+            Pressure levels of the input data, increasing or decreasing.
+            Either a 1-D array of levels, or an array of per-column
+            pressures (e.g. on sigma or hybrid levels) with the same
+            shape as the data, or broadcastable to it.
+        plev_new : 1-D ndarray
+            New pressure levels to interpolate onto, in the same units
+            as plev_in.
+        pdim : int, optional
+            Dimension of vertical levels in data (and in plev_in, if it
+            isn't 1-D).
+        kind : {'linear', 'nearest'}, optional
+            Type of interpolation.
+        logp : bool, optional
+            If True, interpolate linearly in log(p) rather than p.
+
+        Returns
+        -------
+        self : PlevInterpolator object
+            The PlevInterpolator has the following data attributes:
+              plev_new : ndarray
+                New pressure levels.
+              ind, wt : ndarray
+                Index of the level below (in array order) each new level
+                and the weight of the level above it, with the vertical
+                dimension last.  1-D if plev_in is 1-D, otherwise with
+                the same leading dimensions as plev_in.
+              outside : ndarray of bools
+                True where a new level is outside the input levels
+                (e.g. below the surface for per-column pressures).
+                Output at these points is NaN.
+
+            And it has the following method:
+              interp() : Interpolate data onto the new levels.
+        """
+
+        if kind not in ['linear', 'nearest']:
+            raise ValueError('Invalid kind ' + str(kind))
+        self.plev_new = np.asarray(plev_new)
+        self.pdim = pdim
+        self.kind = kind
+        self.logp = logp
+
+        x = np.asarray(plev_in, dtype=np.float64)
+        xnew = np.asarray(plev_new, dtype=np.float64)
+        if logp:
+            x, xnew = np.log(x), np.log(xnew)
+        if x.ndim > 1:
+            x = np.moveaxis(x, pdim, -1)
+        nlev = x.shape[-1]
+        if nlev < 2:
+            raise ValueError('At least 2 input levels are needed')
+
+        # Work with increasing coordinates
+        flip = np.nanmean(np.diff(x, axis=-1)) < 0
+        if flip:
+            x, xnew = -x, -xnew
+
+        if x.ndim == 1:
+            count = np.searchsorted(x, xnew, side='right')
+        else:
+            count = np.zeros(x.shape[:-1] + xnew.shape, dtype=int)
+            for k, xk in enumerate(xnew):
+                count[..., k] = (x <= xk).sum(axis=-1)
+        ind = np.clip(count - 1, 0, nlev - 2)
+
+        x0 = np.take_along_axis(x, ind, axis=-1)
+        x1 = np.take_along_axis(x, ind + 1, axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            wt = np.clip((xnew - x0) / (x1 - x0), 0, 1)
+        if kind == 'nearest':
+            # Midpoints go to the lower pressure, as in interp1d
+            if flip:
+                wt = np.floor(wt + 0.5)
+            else:
+                wt = np.ceil(wt - 0.5)
+
+        self.ind = ind
+        self.wt = wt
+        self.outside = (count == 0) | (xnew > x[..., -1:])
+
+    def __repr__(self):
+        s = 'PlevInterpolator (%s%s)\n' % (self.kind,
+                                             ', log(p)' if self.logp else '')
+        s = s + '  New levels: %s\n' % str(self.plev_new)
+        s = s + '  Columns: %s\n' % str(self.ind.shape[:-1])
+        return s
+
+    def interp(self, data):
+        """Return data interpolated onto the new pressure levels.
+
+        Parameters
+        ----------
+        data : ndarray or xray.DataArray
+            Data on the input levels, with vertical levels along
+            dimension pdim.  Values at a new level that coincides with
+            an input level are taken from that level only, so NaNs
+            below ground don't spread to the level above.
+
+        Returns
+        -------
+        data_i : ndarray or xray.DataArray
+            Interpolated data.
+        """
+
+        if isinstance(data, xray.DataArray):
+            i_DataArray = True
+            name, attrs, coords, _ = xr.meta(data)
+            title = 'Pressure-level data interpolated onto new pressure grid'
+            attrs = utils.odict_insert(attrs, 'title', title, pos=0)
+            pname = get_coord(data, 'plev', 'name')
+            coords[pname] = xray.DataArray(
+                self.plev_new, coords={pname : self.plev_new},
+                attrs=data.coords[pname].attrs)
+            vals = data.values
+        else:
+            i_DataArray = False
+            vals = np.asarray(data)
+
+        # Expand the weights to the number of dimensions of the data
+        v = np.moveaxis(vals, self.pdim, -1)
+        shape = (1,) * (v.ndim - self.ind.ndim) + self.ind.shape
+        ind = self.ind.reshape(shape)
+        wt = self.wt.reshape(shape)
+
+        v0 = np.take_along_axis(v, ind, axis=-1)
+        v1 = np.take_along_axis(v, ind + 1, axis=-1)
+        with np.errstate(invalid='ignore'):
+            vals_i = v0 * (1 - wt) + v1 * wt
+        vals_i = np.where(wt == 0, v0, np.where(wt == 1, v1, vals_i))
+        if self.outside.any():
+            vals_i = np.where(self.outside.reshape(shape), np.nan, vals_i)
+        data_i = np.moveaxis(vals_i, -1, self.pdim)
+
+        if i_DataArray:
+            data_i = xray.DataArray(data_i, name=name, coords=coords,
+                                    attrs=attrs)
+
+        return data_i
+
+
+# ----------------------------------------------------------------------
+def interp_plevels(data, plev_new, plev_in=None, pdim=-3, kind='linear',
+                   logp=False):
     """Return the data interpolated onto new pressure level grid.
 
     Parameters
     ----------
     data : ndarray or xray.DataArray
-        Input data, maximum of 5 dimensions.  Pressure levels must
-        be the last, second-last or third-last dimension.
+        Input data on pressure levels, with any number of dimensions.
     plev_new : ndarray
         New pressure levels to interpolate onto.
     plev_in : ndarray
         Original pressure levels of data.  If data is an xray.DataArray,
         then the values from data.coords are used.
-    pdim : {-3, -2, -1}, optional
+    pdim : int, optional
         Dimension of vertical levels in data.
     kind : string, optional
         Type of interpolation, e.g. 'linear', 'cubic', 'nearest', etc.
         See scipy.interpolate.interp1d for all options.
+    logp : bool, optional
+        If True, interpolate in log(p).  Only used for kind 'linear'
+        and 'nearest'.
 
     Returns
     -------
@@ -1423,86 +3379,134 @@ def interp_plevels(data, plev_new, plev_in=None, pdim=-3, kind='linear'):
         Interpolated data. If input data is an xray.DataArray,
         data_i is returned as an xray.DataArray, otherwise as
         an ndarray.
+
+    Notes
+    -----
+    For kind 'linear' and 'nearest', the interpolation weights are
+    computed with a PlevInterpolator.  To interpolate several variables
+    on the same vertical grid, or with per-column pressures, create a
+    PlevInterpolator once and call its interp() method.
     """
 
-    # Maximum number of dimensions handled by this code
-    nmax = 5
-    ndim = data.ndim
+    if isinstance(data, xray.DataArray):
+        plev_in = get_coord(data, 'plev')
 
-    if ndim > 5:
-        raise ValueError('Input data has too many dimensions. Max 5-D.')
+    # Make sure pressure units are consistent
+    if plev_new.min() < plev_in.min() or plev_new.max() > plev_in.max():
+        raise ValueError('Output pressure levels are not contained '
+            'within input pressure levels.  Check units on each.')
 
+    if kind in ['linear', 'nearest']:
+        interpolator = PlevInterpolator(plev_in, plev_new, pdim, kind, logp)
+        return interpolator.interp(data)
+
+    # Other kinds of interpolation, over all columns in one call
     if isinstance(data, xray.DataArray):
-        i_DataArray = True
-        data = data.copy()
         name, attrs, coords, _ = xr.meta(data)
         title = 'Pressure-level data interpolated onto new pressure grid'
         attrs = utils.odict_insert(attrs, 'title', title, pos=0)
         pname = get_coord(data, 'plev', 'name')
-        plev_in = get_coord(data, 'plev')
         coords[pname] = xray.DataArray(plev_new, coords={pname : plev_new},
             attrs=data.coords[pname].attrs)
+        vals = data.values
     else:
-        i_DataArray = False
+        vals = data
 
-    # Make sure pressure units are consistent
-    if plev_new.min() < plev_in.min() or plev_new.max() > plev_in.max():
-        raise ValueError('Output pressure levels are not contained '
-            'within input pressure levels.  Check units on each.')
+    data_i = interp.interp1d(plev_in, vals, kind=kind, axis=pdim)(plev_new)
 
-    # Add singleton dimensions for looping, if necessary
-    for i in range(ndim, nmax):
-        data = np.expand_dims(data, axis=0)
+    if isinstance(data, xray.DataArray):
+        data_i = xray.DataArray(data_i, name=name, coords=coords,
+                                attrs=attrs)
 
-    # Make sure pdim is indexing from end
-    pdim_in = pdim
-    if pdim > 0:
-        pdim = pdim - nmax
+    return data_i
 
-    # Iterate over all other dimensions
-    dims = list(data.shape)
-    dims[pdim] = len(plev_new)
-    data_i = np.nan*np.ones(dims, dtype=float)
-    dims.pop(pdim)
-    for i in range(dims[0]):
-        for j in range(dims[1]):
-            for k in range(dims[2]):
-                for m in range(dims[3]):
-                    if pdim == -3:
-                        sub = data[i,j,:,k,m]
-                        view = data_i[i,j,:,k,m]
-                    elif pdim == -2:
-                        sub = data[i,j,k,:,m]
-                        view = data_i[i,j,k,:,m]
-                    elif pdim == -1:
-                        sub = data[i,j,k,m,:]
-                        view = data_i[i,j,k,m,:]
-                    else:
-                        raise ValueError('Invalid p dimension ' + str(pdim_in))
-
-                    vals_i = interp.interp1d(plev_in, sub, kind=kind)(plev_new)
-                    view[:] = vals_i
 
-    # Collapse any additional dimensions that were added
-    for i in range(ndim, data_i.ndim):
-        data_i = data_i[0]
+# ----------------------------------------------------------------------
+def dp_weights(plev, ps=None, pdim=-3, pmin=0, pmax=1e6):
+    """Return pressure-thickness weights for vertical integration.
 
-    # Pack data_s into an xray.DataArray if input was in that form
-    if i_DataArray:
-        data_i = xray.DataArray(data_i, name=name, coords=coords,
-                                attrs=attrs)
+    The weights are the trapezoidal rule weights of the pressure levels
+    between pmin and pmax.  If surface pressure is provided, levels
+    below the surface get zero weight and the lowest level above the
+    surface also gets the partial layer between that level and the
+    surface (or pmax, if that is smaller).
 
-    return data_i
+    Parameters
+    ----------
+    plev : 1-D ndarray
+        Vertical pressure levels in Pascals, increasing or decreasing.
+    ps : ndarray or xray.DataArray, optional
+        Surface pressure, either a climatology (e.g. lat, lon) or
+        time-varying (e.g. time, lat, lon).  In Pascals, or in the
+        units given by its 'units' attribute if it is a DataArray.
+    pdim : int, optional
+        Dimension of vertical levels in the output weights.  Only used
+        if ps is provided.  A negative pdim also indexes the data to be
+        integrated, since the weights broadcast against it from the
+        right; a positive pdim is relative to the weights, which have
+        one more dimension than ps.
+    pmin, pmax : float, optional
+        Lower and upper bounds (inclusive) of pressure levels (Pa)
+        to include in integration.
+
+    Returns
+    -------
+    dp : ndarray
+        Pressure thickness (Pa) of each level, so that the integral of
+        data over pressure is sum(data * dp) along pdim.  If ps is None,
+        a 1-D array of the same length as plev, otherwise an array with
+        the shape of ps and the levels inserted at pdim.
+    """
+
+    plev = np.asarray(plev, dtype=np.float64)
+    if isinstance(ps, xray.DataArray):
+        units = ps.attrs.get('units')
+        ps = ps.values
+        if units is not None:
+            ps = pres_convert(ps, units, 'Pa')
+
+    # Compute with levels in order of increasing pressure, along last axis
+    order = np.argsort(plev)
+    p = plev[order]
+    incl = (p >= pmin) & (p <= pmax)
+    if not incl.any():
+        raise ValueError('No pressure levels between pmin and pmax')
+    up = np.zeros(p.shape)
+    up[1:] = (p[1:] - p[:-1]) * incl[:-1]
+    if ps is None:
+        pbot = p[incl].max()
+    else:
+        pbot = np.minimum(np.asarray(ps, dtype=np.float64), pmax)[..., None]
+        if pdim < -pbot.ndim or pdim >= pbot.ndim:
+            raise ValueError('Invalid p dimension ' + str(pdim))
+    valid = incl & (p <= pbot)
+
+    # Half the layer to the next level down, or the whole partial layer
+    # to the surface for the lowest level above ground
+    next_valid = np.zeros(valid.shape, dtype=bool)
+    next_valid[..., :-1] = valid[..., 1:]
+    halfdown = np.append(np.diff(p), 0) / 2
+    down = np.where(next_valid, halfdown, pbot - p)
+    dp = np.where(valid, up / 2 + down, 0)
+
+    # Back to the original level order and position
+    dp = dp[..., np.argsort(order)]
+    if ps is not None:
+        dp = np.moveaxis(dp, -1, pdim)
+
+    return dp
 
 
 # ----------------------------------------------------------------------
-def int_pres(data, plev=None, pdim=-3, pmin=0, pmax=1e6):
+def int_pres(data, plev=None, pdim=-3, pmin=0, pmax=1e6, ps=None,
+             weights=None):
     """Return the mass-weighted vertical integral of the data.
 
     Parameters
     ----------
-    data : xray.DataArray or ndarray
-        Data to be integrated, on pressure levels.
+    data : xray.DataArray, xray.Dataset or ndarray
+        Data to be integrated, on pressure levels.  If a Dataset, each
+        data variable is integrated, using the same weights.
     plev : ndarray, optional
         Vertical pressure levels in Pascals.  Only used if data
         is an ndarray.  If data is a DataArray, plev is extracted
@@ -1512,16 +3516,39 @@ def int_pres(data, plev=None, pdim=-3, pmin=0, pmax=1e6):
     pmin, pmax : float, optional
         Lower and upper bounds (inclusive) of pressure levels (Pa)
         to include in integration.
+    ps : ndarray or xray.DataArray, optional
+        Surface pressure (climatological or time-varying).  If provided,
+        the integral is a single weighted sum with the weights from
+        dp_weights(), which exclude levels below ground and include the
+        layer between the lowest level above ground and the surface.
+        NaNs in the data contribute zero, and the integral is NaN where
+        no level with nonzero weight has valid data.
+    weights : ndarray, optional
+        Precomputed output of dp_weights(), e.g. to integrate several
+        variables on the same grid.  If provided, plev, pmin, pmax and
+        ps are ignored.
 
     Returns
     -------
-    data_int : xray.DataArray or ndarray
+    data_int : xray.DataArray, xray.Dataset or ndarray
         Mass-weighted vertical integral of data from pmin to pmax.
     """
 
+    if isinstance(data, xray.Dataset):
+        data_int = xray.Dataset()
+        for nm in data.data_vars:
+            var = data[nm]
+            if weights is None and ps is not None:
+                pname = get_coord(var, 'plev', 'name')
+                plev_pa = pres_convert(var[pname].values, var[pname].units,
+                                       'Pa')
+                pdim_w = pdim - var.ndim if pdim >= 0 else pdim
+                weights = dp_weights(plev_pa, ps, pdim_w, pmin, pmax)
+            data_int[nm] = int_pres(var, plev, pdim, pmin, pmax, ps, weights)
+        return data_int
+
     if isinstance(data, xray.DataArray):
         i_DataArray = True
-        data = data.copy()
         name, _, coords, _ = xr.meta(data)
         attrs = collections.OrderedDict()
         title = 'Vertically integrated by dp/g'
@@ -1536,22 +3563,49 @@ def int_pres(data, plev=None, pdim=-3, pmin=0, pmax=1e6):
             # -- Make sure pressure levels are in Pa
             plev = get_coord(data, 'plev')
             plev = pres_convert(plev, data[pname].units, 'Pa')
-        data[pname].values = plev
     else:
         i_DataArray = False
-        # Pack into DataArray to easily extract pressure level subset
-        pname = 'plev'
-        coords = xr.coords_init(data)
-        coords = xr.coords_assign(coords, pdim, pname, plev)
-        data = xray.DataArray(data, coords=coords)
 
-    # Extract subset and integrate
-    data = subset(data, {pname : (pmin, pmax)})
-    vals_int = nantrapz(data.values, data[pname].values, axis=pdim)
-    vals_int /= constants.g.values
+    if ps is not None or weights is not None:
+        # Single weighted sum along the vertical dimension
+        vals = np.asarray(data)
+        if pdim < -vals.ndim or pdim >= vals.ndim:
+            raise ValueError('Invalid p dimension ' + str(pdim))
+        # Weights broadcast against the data from the right, so index the
+        # vertical dimension from the right as well
+        if pdim >= 0:
+            pdim = pdim - vals.ndim
+        if weights is None:
+            weights = dp_weights(plev, ps, pdim, pmin, pmax)
+        if weights.ndim == 1:
+            shape = [1] * vals.ndim
+            shape[pdim] = len(weights)
+            weights = weights.reshape(shape)
+        valid = ~np.isnan(vals)
+        vals_int = np.where(valid, vals * weights, 0).sum(axis=pdim)
+        vals_int = vals_int / constants.g.values
+
+        # NaN where no level with nonzero weight has valid data
+        has_data = (valid & (weights != 0)).any(axis=pdim)
+        vals_int = np.where(has_data, vals_int, np.nan)
+    else:
+        if i_DataArray:
+            data = data.copy()
+            data[pname].values = plev
+        else:
+            # Pack into DataArray to easily extract pressure level subset
+            pname = 'plev'
+            coords = xr.coords_init(data)
+            coords = xr.coords_assign(coords, pdim, pname, plev)
+            data = xray.DataArray(data, coords=coords)
+
+        # Extract subset and integrate
+        data = subset(data, {pname : (pmin, pmax)})
+        vals_int = nantrapz(data.values, data[pname].values, axis=pdim)
+        vals_int /= constants.g.values
 
-    if utils.strictly_decreasing(plev):
-        vals_int = -vals_int
+        if utils.strictly_decreasing(plev):
+            vals_int = -vals_int
 
     if i_DataArray:
         data_int = xray.DataArray(vals_int, name=name, coords=coords,
@@ -1764,7 +3818,7 @@ def combine_daily_years(varnames, files, years, yearname='Year',
 
     # Read daily data from each year and concatenate
     if varnames is None:
-        with xray.open_dataset(files[0]) as ds0:
+        with _open_dataset(files[0]) as ds0:
             varlist = ds0.data_vars.keys()
     else:
         varlist = utils.makelist(varnames)
@@ -1772,7 +3826,7 @@ def combine_daily_years(varnames, files, years, yearname='Year',
     for y, filn in enumerate(files):
         print('Loading ' + filn)
         ds1 = xray.Dataset()
-        with xray.open_dataset(filn) as ds_in:
+        with _open_dataset(filn) as ds_in:
             if subset_dict is not None:
                 ds_in = subset(ds_in, subset_dict)
             for nm in varlist:
@@ -35,7 +35,7 @@ def divergence_spherical_2d(Fx, Fy, lat=None, lon=None):
         Longitude, latitude components of a vector function in
         spherical coordinates.  Latitude and longitude should be the
         second-last and last dimensions, respectively, of Fx and Fy.
-        Maximum size 5-D.
+        Any number of leading dimensions is allowed.
     lat, lon : ndarrays, optional
         Longitude and latitude in degrees.  If these are omitted, then
         Fx and Fy must be xray.DataArrays with latitude and longitude
@@ -46,6 +46,12 @@ def divergence_spherical_2d(Fx, Fy, lat=None, lon=None):
     d, d1, d2 : ndarrays or xray.DataArrays
         d1 = dFx/dx, d2 = dFy/dy, and d = d1 + d2.
 
+    Notes
+    -----
+    Each derivative is computed over the whole array at once with
+    atmos.data.gradient().  If the longitudes span the globe, the
+    longitude derivative wraps around (periodic stencil).
+
     Reference
     ---------
     Atmospheric and Oceanic Fluid Dynamics: Fundamentals and
@@ -53,11 +59,6 @@ def divergence_spherical_2d(Fx, Fy, lat=None, lon=None):
     University Press, 2006 -- Equation 2.30.
     """
 
-    nmax = 5
-    ndim = Fx.ndim
-    if ndim > nmax:
-        raise ValueError('Input data has too many dimensions. Max 5-D.')
-
     if isinstance(Fx, xray.DataArray):
         i_DataArray = True
         name, attrs, coords, _ = xr.meta(Fx)
@@ -65,50 +66,31 @@ def divergence_spherical_2d(Fx, Fy, lat=None, lon=None):
             lat = get_coord(Fx, 'lat')
         if lon is None:
             lon = get_coord(Fx, 'lon')
+        Fx = Fx.values
     else:
         i_DataArray = False
         if lat is None or lon is None:
             raise ValueError('Lat/lon inputs must be provided when input '
                 'data is an ndarray.')
+    if isinstance(Fy, xray.DataArray):
+        Fy = Fy.values
 
     R = constants.radius_earth.values
+    lat = np.asarray(lat)
     lon_rad = np.radians(lon)
     lat_rad = np.radians(lat)
+    if dat.lon_periodic(lon):
+        period = 2 * np.pi
+    else:
+        period = None
 
-    # Add singleton dimensions for looping, if necessary
-    for i in range(ndim, nmax):
-        Fx = np.expand_dims(Fx, axis=0)
-        Fy = np.expand_dims(Fy, axis=0)
-
-    dims = Fx.shape
-    nlon = dims[-1]
-    nlat = dims[-2]
+    # Metric factors as columns, to broadcast along longitude
+    coslat = np.cos(lat_rad)[:, None]
+    d1 = dat.gradient(Fx, lon_rad, axis=-1, period=period) / (R * coslat)
 
-    d1 = np.zeros(dims, dtype=float)
-    d2 = np.zeros(dims, dtype=float)
-
-    for i in range(nlat):
-        dx = np.gradient(lon_rad)
-        coslat = np.cos(lat_rad[i])
-        for k1 in range(dims[0]):
-            for k2 in range(dims[1]):
-                for k3 in range(dims[2]):
-                    sub = Fx[k1,k2,k3,i,:]
-                    d1[k1,k2,k3,i,:] = np.gradient(sub, dx) / (R*coslat)
-    for j in range(nlon):
-        dy = np.gradient(lat_rad)
-        coslat = np.cos(lat_rad)
-        # Set to NaN at poles to keep from blowing up
-        coslat[abs(lat) > 89] = np.nan
-        for k1 in range(dims[0]):
-            for k2 in range(dims[1]):
-                for k3 in range(dims[2]):
-                    sub = Fy[k1,k2,k3,:,j] * coslat
-                    d2[k1,k2,k3,:,j] = np.gradient(sub, dy) / (R*coslat)
-
-    # Collapse any additional dimensions that were added
-    for i in range(ndim, d1.ndim):
-        d1, d2 = d1[0], d2[0]
+    # Set to NaN at poles to keep from blowing up
+    coslat = np.where(abs(lat) > 89, np.nan, np.cos(lat_rad))[:, None]
+    d2 = dat.gradient(Fy * coslat, lat_rad, axis=-2) / (R * coslat)
 
     d = d1 + d2
 
@@ -309,7 +291,8 @@ def moist_static_energy(T, z, q):
 
 # ----------------------------------------------------------------------
 def moisture_flux_conv(uq, vq, lat=None, lon=None, plev=None, pdim=-3,
-                       pmin=0, pmax=1e6, return_comp=False, already_int=False):
+                       pmin=0, pmax=1e6, return_comp=False, already_int=False,
+                       ps=None):
     """Return the vertically integrated moisture flux convergence.
 
     Parameters
@@ -345,6 +328,10 @@ def moisture_flux_conv(uq, vq, lat=None, lon=None, plev=None, pdim=-3,
         If True, then uq and vq inputs have already been vertically
         integrated.  Otherwise, the vertical integration is
         calculated here.
+    ps : ndarray or xray.DataArray, optional
+        Surface pressure for the vertical integration (see
+        atmos.data.int_pres).  The integration weights are computed
+        once and used for both uq and vq.
 
     Returns
     -------
@@ -363,8 +350,22 @@ def moisture_flux_conv(uq, vq, lat=None, lon=None, plev=None, pdim=-3,
     if already_int:
         uq_int, vq_int = uq, vq
     else:
-        uq_int = dat.int_pres(uq, plev, pdim=pdim, pmin=pmin, pmax=pmax)
-        vq_int = dat.int_pres(vq, plev, pdim=pdim, pmin=pmin, pmax=pmax)
+        if ps is not None:
+            if plev is None:
+                pname = get_coord(uq, 'plev', 'name')
+                plev = dat.pres_convert(uq[pname].values, uq[pname].units,
+                                        'Pa')
+            # Weights broadcast against the data from the right, so index
+            # the vertical dimension from the right as well
+            if pdim >= 0:
+                pdim = pdim - np.ndim(uq)
+            weights = dat.dp_weights(plev, ps, pdim, pmin, pmax)
+        else:
+            weights = None
+        uq_int = dat.int_pres(uq, plev, pdim=pdim, pmin=pmin, pmax=pmax,
+                              weights=weights)
+        vq_int = dat.int_pres(vq, plev, pdim=pdim, pmin=pmin, pmax=pmax,
+                              weights=weights)
 
     mfc, mfc_x, mfc_y = divergence_spherical_2d(uq_int, vq_int, lat, lon)
 
@@ -450,9 +451,9 @@ def streamfunction(v, lat=None, pres=None, pdim=None, scale=1e-9,
     dims[pdim] += 1
     nlat = dims[-2]
 
-    # Tile the pressure levels to make a grid
+    # Broadcast the pressure levels to make a grid
     pmid = np.zeros(dims, dtype=float)
-    pmid[...,:-1,:,:] = dat.biggify(pres, v, tile=True)
+    pmid[...,:-1,:,:] = dat.biggify(pres, v, tile='view')
 
     # Cosine-weighted meridional velocity
     coslat = np.cos(np.radians(lat))
@@ -198,6 +198,83 @@ def coords_assign(coords, dim, new_name, new_val):
     return new_coords
 
 
+# ----------------------------------------------------------------------
+def subset_indexers(data, subset_dict, incl_lower=True, incl_upper=True):
+    """Return integer indexers of a subset, for use with isel().
+
+    Only the coordinate values are read, so the indexers can be applied
+    to file-backed data before any of the data values are loaded.
+
+    For a monotonic coordinate, the bounds of a range are found with a
+    binary search and the indexer is a slice, so that isel() returns a
+    view of the data.  Explicit lists of values and ranges of
+    non-monotonic coordinates are found by label / comparison.
+
+    Parameters
+    ----------
+    data : xray.DataArray or xray.Dataset
+        Data source for extraction.
+    subset_dict : dict of 2-tuples
+        Dimensions and subsets to extract, as in subset().
+    incl_lower, incl_upper : bool, optional
+        If True lower / upper bound is inclusive, with >= or <=.
+        If False, lower / upper bound is exclusive with > or <.
+
+    Returns
+    -------
+    indexers : dict
+        Dict of dim_name : indexer, where each indexer is a slice if the
+        subset is a contiguous range, otherwise an array of integers.
+    """
+
+    indexers = {}
+    for dim_name in subset_dict:
+        lower_or_list, upper = subset_dict[dim_name]
+        index = data.indexes[dim_name]
+        if upper is None:
+            labels = np.atleast_1d(lower_or_list)
+            ind = index.get_indexer(labels)
+            if (ind < 0).any():
+                raise KeyError('Values %s not found in %s' %
+                               (str(labels[ind < 0]), dim_name))
+            if np.ndim(lower_or_list) == 0:
+                indexers[dim_name] = int(ind[0])
+                continue
+        elif index.is_monotonic_increasing or index.is_monotonic_decreasing:
+            n = len(index)
+            decreasing = not index.is_monotonic_increasing
+            if decreasing:
+                index = index[::-1]
+            i1 = index.searchsorted(lower_or_list,
+                                    side='left' if incl_lower else 'right')
+            i2 = index.searchsorted(upper,
+                                    side='right' if incl_upper else 'left')
+            i1, i2 = int(i1), int(max(i1, i2))
+            if decreasing:
+                i1, i2 = n - i2, n - i1
+            indexers[dim_name] = slice(i1, i2)
+            continue
+        else:
+            vals = data[dim_name].values
+            if incl_lower:
+                ind1 = vals >= lower_or_list
+            else:
+                ind1 = vals > lower_or_list
+            if incl_upper:
+                ind2 = vals <= upper
+            else:
+                ind2 = vals < upper
+            ind = np.where(ind1 & ind2)[0]
+        if len(ind) == 0:
+            indexers[dim_name] = slice(0, 0)
+        elif (np.diff(ind) == 1).all():
+            indexers[dim_name] = slice(int(ind[0]), int(ind[-1]) + 1)
+        else:
+            indexers[dim_name] = ind
+
+    return indexers
+
+
 # ----------------------------------------------------------------------
 def subset(data, subset_dict, incl_lower=True, incl_upper=True,
            copy=True, apply_squeeze=False):
@@ -231,6 +308,9 @@ def subset(data, subset_dict, incl_lower=True, incl_upper=True,
         and these parameters are ignored.
     copy : bool, optional
         If True, return a copy of the data, otherwise return a pointer.
+        (For ranges of monotonic coordinates, the pointer is a view of
+        the input data.  For lists of values or ranges of non-monotonic
+        coordinates, the data is always copied.)
     apply_squeeze : bool, optional
         If True, squeeze out any singleton dimensions.
 
@@ -239,32 +319,11 @@ def subset(data, subset_dict, incl_lower=True, incl_upper=True,
         sub : xray.DataArray or xray.Dataset
     """
 
-    def subset_1dim(data, dim_name, lower_or_list, upper=None,
-                     incl_lower=True, incl_upper=True, copy=True):
-        """Extract a subset of a DataArray along a named dimension."""
-        vals = data[dim_name]
-        if upper is None:
-            valrange = lower_or_list
-        else:
-            if incl_lower:
-                ind1 = vals >= lower_or_list
-            else:
-                ind1 = vals > lower_or_list
-            if incl_upper:
-                ind2 = vals <= upper
-            else:
-                ind2 = vals < upper
-            valrange = vals[ind1 & ind2]
-        data_out = data.sel(**{dim_name : valrange})
-        if copy:
-            data_out = data_out.copy()
-        return data_out
-
-    sub = data
-    for dim_name in subset_dict:
-        lower_or_list, upper = subset_dict[dim_name]
-        sub = subset_1dim(sub, dim_name, lower_or_list, upper, incl_lower,
-                          incl_upper, copy)
+    # Convert to integer indices and subset all dimensions at once
+    indexers = subset_indexers(data, subset_dict, incl_lower, incl_upper)
+    sub = data.isel(**indexers)
+    if copy:
+        sub = sub.copy()
 
     if apply_squeeze:
         sub = squeeze(sub)
@@ -302,28 +361,38 @@ def ds_print(ds, indent=2, width=None):
 
 # ----------------------------------------------------------------------
 def ds_unpack(dataset, missing_name=u'missing_value', offset_name=u'add_offset',
-              scale_name=u'scale_factor', verbose=False, dtype=np.float64):
+              scale_name=u'scale_factor', verbose=False, dtype=np.float64,
+              chunksize=None):
     """
     Unpack compressed data from an xray.Dataset object.
 
     Converts compressed int data to floats and missing values to NaN.
     Returns the results in an xray.Dataset object.
+
+    Each variable is unpacked in chunks along its first dimension into
+    a preallocated output array of type dtype (e.g. np.float32 to halve
+    the memory), so that for a Dataset opened from file, only about one
+    output array's worth of memory is needed per variable.  The chunk
+    size (number of elements along the first dimension) is chosen to
+    read about 10 million values at a time unless chunksize is given.
     """
     ds = dataset
     for var in ds.data_vars:
         print_if(var, verbose)
-        vals = ds[var].values
+        variable = ds[var].variable
         attrs = ds[var].attrs
         print_if(attrs, verbose, printfunc=utils.print_odict)
 
+        if variable.dtype.kind not in 'biuf':
+            print_if('Non-numeric data, skipping', verbose)
+            continue
+
         # Flag missing values for further processing
         if missing_name in attrs:
             missing_val = attrs[missing_name]
-            imissing = vals == missing_val
             print_if('missing_val ' + str(missing_val), verbose)
-            print_if('Found ' + str(imissing.sum()) + ' missings', verbose)
         else:
-            imissing = []
+            missing_val = None
             print_if('Missing values not flagged in input file', verbose)
 
         # Get offset and scaling factors, if any
@@ -340,14 +409,34 @@ def ds_unpack(dataset, missing_name=u'missing_value', offset_name=u'add_offset',
             scale_val = 1.0
             print_if('No scaling in input file, setting to 1.0', verbose)
 
-        # Convert from int to float with the offset and scaling
-        vals = vals * scale_val + offset_val
-
-        # Replace missing values with NaN
-        vals[imissing] = np.nan
+        # Convert from int to float with the offset and scaling, one
+        # chunk at a time, in place in the output array
+        vals = np.empty(variable.shape, dtype=dtype)
+        if variable.ndim == 0:
+            chunks = [Ellipsis]
+        else:
+            n = variable.shape[0]
+            size = max(1, int(np.prod(variable.shape[1:])))
+            step = chunksize or max(1, int(1e7 // size))
+            chunks = [slice(i, min(i + step, n)) for i in range(0, n, step)]
+        nmissing = 0
+        for ind in chunks:
+            packed = np.asarray(variable[ind].values)
+            out = vals[ind]
+            out[...] = packed
+            out *= scale_val
+            out += offset_val
+
+            # Replace missing values with NaN
+            if missing_val is not None:
+                imissing = packed == missing_val
+                nmissing += imissing.sum()
+                out[imissing] = np.nan
+        if missing_val is not None:
+            print_if('Found ' + str(nmissing) + ' missings', verbose)
 
         # Replace the values in dataset with the converted ones
-        ds[var].values = vals.astype(dtype)
+        ds[var].values = vals
 
     return ds
 
@@ -0,0 +1,39 @@
+"""Testing dim_mean with return_count and return_std"""
+
+import numpy as np
+import xray
+
+import atmos.data as dat
+
+# ----------------------------------------------------------------------
+# 3-D field with missing values
+# ----------------------------------------------------------------------
+ntime, nlat, nlon = 30, 10, 20
+lat = np.linspace(-45, 45, nlat)
+lon = np.linspace(0, 360, nlon, endpoint=False)
+vals = np.random.randn(ntime, nlat, nlon)
+vals[:10, 0, 0] = np.nan
+vals[:, 1, 1] = np.nan
+data = xray.DataArray(vals, dims=['day', 'lat', 'lon'],
+                      coords={'day' : np.arange(ntime), 'lat' : lat,
+                              'lon' : lon})
+
+databar, count, std = dat.dim_mean(data, 'day', return_count=True,
+                                   return_std=True)
+print(np.allclose(databar.values, np.nanmean(vals, axis=0), equal_nan=True))
+print(np.allclose(std.values, np.nanstd(vals, axis=0), equal_nan=True))
+print(count.values[0, 0], count.values[1, 1])
+
+# ----------------------------------------------------------------------
+# 1-D time series (scalar output)
+# ----------------------------------------------------------------------
+ts = data[:, 5, 5]
+tsbar, count, std = dat.dim_mean(ts, 'day', return_count=True,
+                                 return_std=True)
+print(tsbar.values, np.nanmean(ts.values))
+print(std.values, np.nanstd(ts.values))
+
+# All-missing time series
+ts = data[:, 1, 1]
+tsbar, std = dat.dim_mean(ts, 'day', return_std=True)
+print(tsbar.values, std.values)
@@ -0,0 +1,63 @@
+"""Benchmark atmos.data.gradient against a looped np.gradient reference."""
+
+import time
+import numpy as np
+
+import atmos.data as dat
+
+# ----------------------------------------------------------------------
+def gradient_loop(vals, vec, axis=-1):
+    """Reference: np.gradient on each 1-D column, with vec as coordinates.
+
+    This has the loop structure of the previous implementation, which
+    passed np.gradient(vec) instead of vec.  With NumPy >= 1.13 that
+    argument is treated as coordinates rather than spacing, so the old
+    call does not give d/dvec and is not reproduced here.
+    """
+    nmax = 5
+    ndim = vals.ndim
+    vals = np.rollaxis(vals, axis, ndim)
+    for i in range(ndim, nmax):
+        vals = np.expand_dims(vals, axis=0)
+    grad = np.ones(vals.shape, dtype=vals.dtype)
+    dims = vals.shape[:-1]
+    for i in range(dims[0]):
+        for j in range(dims[1]):
+            for k in range(dims[2]):
+                for m in range(dims[3]):
+                    grad[i,j,k,m] = np.gradient(vals[i,j,k,m], vec)
+    for i in range(ndim, grad.ndim):
+        grad = grad[0]
+    grad = np.rollaxis(grad, -1, axis)
+    return grad
+
+
+def timeit(func, *args, **kwargs):
+    t0 = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - t0
+
+# ----------------------------------------------------------------------
+# Synthetic 6-hourly data: time x plev x lat x lon
+ntime, nlev, nlat, nlon = 124, 17, 73, 144
+lat = np.linspace(-90, 90, nlat)
+lon = np.arange(0, 360, 360.0 / nlon)
+plev = np.array([1000, 925, 850, 700, 600, 500, 400, 300, 250, 200, 150,
+                 100, 70, 50, 30, 20, 10], dtype=float) * 100
+u = np.random.randn(ntime, nlev, nlat, nlon)
+
+for vec, axis, label in [(np.radians(lon), -1, 'lon (uniform)'),
+                         (np.radians(lat), -2, 'lat (uniform)'),
+                         (plev, 1, 'plev (non-uniform)')]:
+    grad0, t0 = timeit(gradient_loop, u, vec, axis)
+    grad1, t1 = timeit(dat.gradient, u, vec, axis)
+    print('%s: np.gradient loop %.3f s, vectorized %.3f s, speedup %.1fx, '
+          'max diff %.2e'
+          % (label, t0, t1, t0 / t1, abs(grad1 - grad0).max()))
+
+# float32 in, float32 out, and reuse of an output buffer
+u32 = u.astype(np.float32)
+buf = np.empty(u32.shape, dtype=np.float32)
+grad32, t32 = timeit(dat.gradient, u32, plev, 1, out=buf)
+print('float32 with out buffer: %.3f s, dtype %s, same buffer %s'
+      % (t32, grad32.dtype, grad32 is buf))
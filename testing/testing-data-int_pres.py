@@ -77,3 +77,22 @@ plt.subplot(312)
 ap.contourf_latlon(scale*u_int[m], clev=cint)
 plt.subplot(313)
 ap.contourf_latlon(scale*u_int2[m], lat, lon, clev=cint)
+
+# ----------------------------------------------------------------------
+# Integrate down to the surface, with weights shared between variables
+dp = dat.dp_weights(plev*100, topo, pdim=-3)
+u_int3 = int_pres(u, pdim=-3, weights=dp)
+v_int3 = int_pres(v, pdim=-3, weights=dp)
+ds_int = int_pres(ds[['u', 'v']], pdim=-3, ps=topo)
+print(abs(ds_int['u'] - u_int3).max())
+
+m = 3
+plt.figure(figsize=(7,7))
+plt.subplot(211)
+ap.contourf_latlon(int_pres(u, pdim=-3)[m], clev=cint)
+plt.subplot(212)
+ap.contourf_latlon(u_int3[m], clev=cint)
+
+# Positive pdim with climatological surface pressure
+u_int4 = int_pres(u, pdim=1, ps=topo)
+print(u_int4.dims, abs(u_int4 - ds_int['u']).max())
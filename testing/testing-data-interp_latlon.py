@@ -46,3 +46,33 @@ plt.subplot(312)
 ap.pcolor_latlon(ps_i[t], cmap=cmap)
 plt.subplot(313)
 ap.pcolor_latlon(ps_i2[t], lat_new, lon_new, cmap=cmap)
+
+# ----------------------------------------------------------------------
+# Regridder - weights computed once and reused
+
+regridder = dat.Regridder(lat, lon, lat_new, lon_new, 'bilinear',
+                          filename='data/more/regrid_ncep2_1deg.npz')
+print(regridder)
+
+ps_i3 = regridder.regrid(ps)
+u_i = regridder.regrid(u)
+print(abs(ps_i3 - ps_i).max())
+
+# Weights read back from file
+regridder2 = dat.Regridder.load('data/more/regrid_ncep2_1deg.npz')
+print(abs(regridder2.regrid(ps) - ps_i3).max())
+
+# ----------------------------------------------------------------------
+# Conservative regridding - area integrals are preserved
+
+def global_mean(data):
+    lat = get_coord(data, 'lat')
+    coslat = np.cos(np.radians(lat))
+    return (data.mean(dim=get_coord(data, 'lon', 'name')) * coslat).sum(
+        dim=get_coord(data, 'lat', 'name')) / coslat.sum()
+
+lat_coarse = np.arange(-88.75, 90, 2.5)
+lon_coarse = np.arange(1.25, 360, 2.5)
+regridder = dat.Regridder(lat, lon, lat_coarse, lon_coarse, 'conservative')
+ps_c = regridder.regrid(ps)
+print(global_mean(ps) - global_mean(ps_c))
@@ -64,3 +64,15 @@ plt.subplot(312)
 ap.contour_latpres(u_i[m,:,:,j], clev=cint)
 plt.subplot(313)
 ap.contour_latpres(u_i2[m,:,:,j], lat, plev, clev=cint)
+
+# ----------------------------------------------------------------------
+# PlevInterpolator - weights shared by variables on the same grid
+
+interpolator = dat.PlevInterpolator(plev, plev_new, pdim=-3)
+u_i3 = interpolator.interp(u)
+v_i3 = interpolator.interp(v)
+T_i3 = interpolator.interp(T)
+print(abs(u_i3 - u_i).max())
+
+# Interpolation in log(p)
+T_ilog = interp_plevels(T, plev_new, pdim=-3, logp=True)
@@ -26,3 +26,33 @@ ds2 = load_concat(paths, var_ids, subset_dict=subset_dict)
 ds3 = load_concat(paths, 'PS', subset_dict=subset_dict)
 u1 = load_concat(paths, 'U')
 u2 = load_concat(paths[0], 'U')
+
+# ----------------------------------------------------------------------
+# Streaming: one file at a time, or written straight to disk
+usum, n = 0, 0
+for piece in dat.load_concat_iter(paths, 'U', subset_dict=subset_dict):
+    usum = usum + piece['U'].sum(dim='TIME')
+    n += piece['U'].shape[0]
+ubar = usum / n
+
+u3 = load_concat(paths, 'U', subset_dict=subset_dict, outfile='u_concat.nc')
+
+# ----------------------------------------------------------------------
+# Cache the subsets locally, then re-read them without the network
+ds4 = load_concat(paths, var_ids, subset_dict=subset_dict, cache=True)
+ds5 = load_concat(paths, var_ids, subset_dict=subset_dict, offline=True)
+
+# The cache key for func must be the same in every new process, even
+# when func contains a comprehension or lambda
+import subprocess
+import sys
+
+script = '\n'.join([
+    'import atmos.data as dat',
+    'def func(ds):',
+    '    scale = lambda x: 2 * x',
+    '    return ds[[nm for nm in ds.data_vars]].pipe(scale)',
+    'print(dat._grid_hash(dat._func_key(func)))'])
+keys = [subprocess.check_output([sys.executable, '-c', script]).strip()
+        for i in range(2)]
+print(keys, keys[0] == keys[1])
@@ -96,3 +96,18 @@ avg4 = mean_over_geobox(T, lat1-delta, lat1+delta, lon1, lon2)
 plt.figure()
 plt.plot(avg3[t])
 plt.plot(avg4[t])
+
+# ----------------------------------------------------------------------
+# Multiple boxes at once
+import collections
+from atmos.data import mean_over_geoboxes
+
+boxes = collections.OrderedDict()
+boxes['SASM'] = (10, 30, 60, 100)
+boxes['EASM'] = (20, 40, 110, 130)
+boxes['Nino3.4'] = (-5, 5, 190, 240)
+
+avgs = mean_over_geoboxes(T, boxes)
+for nm in boxes:
+    avg = mean_over_geobox(T, *boxes[nm])
+    print(nm, abs(avgs.sel(region=nm) - avg).max().values)
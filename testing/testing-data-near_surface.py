@@ -50,3 +50,8 @@ plt.subplot(223)
 ap.pcolor_latlon(u_s2[m], lat, lon, cmap='jet')
 plt.subplot(224)
 ap.pcolor_latlon(ind_s[m], lat, lon, cmap='jet')
+
+# Single column (1-D, pdim=-1)
+col = np.array([np.nan, np.nan, 3.0, 4.0])
+print(near_surface(col, pdim=-1, return_inds=True))
+print(near_surface(np.nan * col, pdim=-1, return_inds=True))
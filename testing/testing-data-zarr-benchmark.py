@@ -0,0 +1,65 @@
+"""Benchmark reading netCDF vs. Zarr with the atmos.data I/O functions."""
+
+import os
+import shutil
+import time
+import numpy as np
+import xray
+
+import atmos.data as dat
+
+# ----------------------------------------------------------------------
+def timeit(func, *args, **kwargs):
+    t0 = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - t0
+
+# ----------------------------------------------------------------------
+# Synthetic daily data: time x plev x lat x lon, written one month at
+# a time by appending along time
+ntime, nlev, nlat, nlon = 360, 17, 73, 144
+lat = np.linspace(-90, 90, nlat)
+lon = np.arange(0, 360, 360.0 / nlon)
+plev = np.array([1000, 925, 850, 700, 600, 500, 400, 300, 250, 200, 150,
+                 100, 70, 50, 30, 20, 10], dtype=float)
+coords = {'lat' : lat, 'lon' : lon, 'plev' : plev}
+dims = ('day', 'plev', 'lat', 'lon')
+
+files = {'netcdf' : 'benchmark.nc', 'zarr' : 'benchmark.zarr'}
+for fmt in files:
+    if os.path.isdir(files[fmt]):
+        shutil.rmtree(files[fmt])
+    elif os.path.exists(files[fmt]):
+        os.remove(files[fmt])
+
+for d1 in range(0, ntime, 30):
+    days = np.arange(d1, d1 + 30)
+    u = xray.DataArray(np.random.randn(30, nlev, nlat, nlon).astype('f4'),
+                       dims=dims, coords=dict(coords, day=days), name='u')
+    for fmt in files:
+        _, t = timeit(dat.save_nc, files[fmt], u, append_dim='day',
+                      chunks='auto', complevel=1)
+        print('Append days %d-%d to %s: %.2f s' % (d1, d1 + 29, fmt, t))
+
+# ----------------------------------------------------------------------
+# Full read, one time step, and a small spatial window at one level
+def read_full(filename):
+    return dat.ncload(filename, verbose=False, unpack=False)
+
+def read_window(filename, **indexers):
+    ds = dat.ncload(filename, verbose=False, lazy=True)
+    vals = ds['u'].isel(**indexers).values
+    ds.close()
+    return vals
+
+windows = {'one day' : {'day' : 100},
+           'region, one level' : {'plev' : 5, 'lat' : slice(40, 50),
+                                  'lon' : slice(20, 40)},
+           'point timeseries' : {'plev' : 5, 'lat' : 45, 'lon' : 30}}
+
+for fmt in files:
+    _, t = timeit(read_full, files[fmt])
+    print('%s full read: %.2f s' % (fmt, t))
+    for label in windows:
+        _, t = timeit(read_window, files[fmt], **windows[label])
+        print('%s %s: %.3f s' % (fmt, label, t))
@@ -47,6 +47,11 @@ mfc3, mfc_x, mfc_y, uq_int, vq_int = moisture_flux_conv(
 # pmin, pmax
 mfc_sub = moisture_flux_conv(uq, vq, pmin=600e2, pmax=900e2)
 
+# Climatological surface pressure, with pdim counted from the left
+mfc_ps = moisture_flux_conv(uq, vq, ps=topo)
+mfc_ps2 = moisture_flux_conv(uq, vq, pdim=1, ps=topo)
+print(abs(mfc_ps2 - mfc_ps).max())
+
 cmax = 12
 plt.figure(figsize=(7,10))
 plt.subplot(311)